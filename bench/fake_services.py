@@ -0,0 +1,254 @@
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class FakeServer:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.httpd = None
+
+    def count(self, name: str, n: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(random.uniform(self.latency * 0.5, self.latency * 1.5))
+
+    def roll(self, rate: float) -> bool:
+        return rate > 0 and random.random() < rate
+
+    def start(self) -> str:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status: int, body):
+                raw = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/octet-stream" if isinstance(body, bytes) else "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def read_body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def do_GET(self):
+                server.delay()
+                status, body = server.handle_get(self.path)
+                self.reply(status, body)
+
+            def do_POST(self):
+                raw = self.read_body()
+                server.delay()
+                status, body = server.handle_post(self.path, raw, self.headers.get("Content-Type") or "")
+                self.reply(status, body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def handle_get(self, path: str):
+        return 404, {"error": "not found"}
+
+    def handle_post(self, path: str, raw: bytes, content_type: str):
+        return 404, {"error": "not found"}
+
+class FakeParcels(FakeServer):
+    def __init__(self, polls_until_done: int = 1, change_rate: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.polls_until_done = polls_until_done
+        self.change_rate = change_rate
+        self.generation = 0
+        self.events = {}
+        self.lookups = {}
+
+    def next_generation(self):
+        with self.lock:
+            self.generation += 1
+            for track_no in list(self.events):
+                if self.roll(self.change_rate):
+                    self.events[track_no] += 1
+
+    def shipment(self, track_no: str) -> dict:
+        with self.lock:
+            count = self.events.setdefault(track_no, 1)
+
+        states = [
+            {
+                "date": f"2024-01-{1 + i % 28:02d}T{i % 24:02d}:00:00Z",
+                "status": f"Event {i} for {track_no}",
+                "location": "Kyiv" if i % 2 else "Warsaw",
+            }
+            for i in range(count)
+        ]
+        return {
+            "trackingId": track_no.upper(),
+            "status": "transit",
+            "origin": "Poland",
+            "originCode": "PL",
+            "destination": "Ukraine",
+            "destinationCode": "UA",
+            "states": states,
+            "lastState": states[-1],
+        }
+
+    def check_failure(self):
+        if self.roll(self.throttle_rate):
+            self.count("throttled")
+            return 429, {"error": "Too many requests"}
+        if self.roll(self.error_rate):
+            self.count("errors")
+            return 500, {"error": "Internal error"}
+        return None
+
+    def handle_post(self, path: str, raw: bytes, content_type: str):
+        self.count("post")
+        failure = self.check_failure()
+        if failure:
+            return failure
+
+        payload = json.loads(raw or b"{}")
+        track_nos = [s.get("trackingId") for s in payload.get("shipments") or []]
+        self.count("post_shipments", len(track_nos))
+
+        if self.polls_until_done <= 0:
+            return 200, {"done": True, "shipments": [self.shipment(tn) for tn in track_nos]}
+
+        lookup_id = uuid.uuid4().hex
+        with self.lock:
+            self.lookups[lookup_id] = {"track_nos": track_nos, "polls": 0}
+
+        return 200, {"uuid": lookup_id, "done": False, "shipments": []}
+
+    def handle_get(self, path: str):
+        self.count("get")
+        failure = self.check_failure()
+        if failure:
+            return failure
+
+        lookup_id = (parse_qs(urlparse(path).query).get("uuid") or [""])[0]
+        with self.lock:
+            lookup = self.lookups.get(lookup_id)
+            if lookup:
+                lookup["polls"] += 1
+                done = lookup["polls"] >= self.polls_until_done
+                if done:
+                    self.lookups.pop(lookup_id, None)
+
+        if not lookup:
+            return 200, {"error": "Unknown uuid"}
+
+        if not done:
+            return 200, {"done": False, "shipments": []}
+
+        return 200, {"done": True, "shipments": [self.shipment(tn) for tn in lookup["track_nos"]]}
+
+class FakeTelegram(FakeServer):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.files = {}
+        self.updates = []
+        self.update_ids = itertools.count(1)
+        self.updates_ready = threading.Condition(self.lock)
+
+    def add_file(self, content: bytes) -> str:
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = content
+        return file_id
+
+    def push_update(self, message: dict):
+        with self.updates_ready:
+            self.updates.append({"update_id": next(self.update_ids), "message": message})
+            self.updates_ready.notify_all()
+
+    def get_updates(self, raw: bytes) -> list:
+        form = parse_qs(raw.decode("utf-8"))
+        offset = int((form.get("offset") or ["0"])[0])
+        limit = int((form.get("limit") or ["100"])[0])
+        timeout = float((form.get("timeout") or ["0"])[0])
+
+        with self.updates_ready:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates and timeout > 0:
+                self.updates_ready.wait(min(timeout, 1.0))
+            return self.updates[:limit]
+
+    def handle_get(self, path: str):
+        self.count("file")
+        file_id = path.rsplit("/", 1)[-1]
+        with self.lock:
+            content = self.files.get(file_id)
+        if content is None:
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+        return 200, content
+
+    def handle_post(self, path: str, raw: bytes, content_type: str):
+        method = path.rsplit("/", 1)[-1]
+
+        if method == "getFile":
+            file_id = (parse_qs(raw.decode("utf-8")).get("file_id") or [""])[0]
+            return 200, {"ok": True, "result": {"file_id": file_id, "file_path": f"documents/{file_id}"}}
+
+        if method == "getUpdates":
+            self.count("get_updates")
+            return 200, {"ok": True, "result": self.get_updates(raw)}
+
+        if method == "deleteWebhook":
+            return 200, {"ok": True, "result": True}
+
+        if method == "editMessageText":
+            self.count("edit")
+            return 200, {"ok": True, "result": {"message_id": 1}}
+
+        if method != "sendMessage":
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+        self.count("send")
+
+        if self.roll(self.throttle_rate):
+            self.count("throttled")
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }
+
+        if self.roll(self.error_rate):
+            self.count("errors")
+            return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+
+        self.count("delivered")
+        return 200, {"ok": True, "result": {"message_id": 1}}
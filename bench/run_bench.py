@@ -0,0 +1,361 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_services import FakeParcels, FakeTelegram
+
+MONGO_OPS = {
+    "aggregate",
+    "bulk_write",
+    "count_documents",
+    "create_index",
+    "delete_many",
+    "delete_one",
+    "estimated_document_count",
+    "find",
+    "find_one",
+    "find_one_and_delete",
+    "find_one_and_update",
+    "insert_many",
+    "insert_one",
+    "replace_one",
+    "update_many",
+    "update_one",
+    "watch",
+}
+
+TRACKER_COLLECTIONS = {
+    "users": "users",
+    "trackings": "trackings",
+    "subscriptions": "subscriptions",
+    "parcels_cache_store": "parcels_cache",
+    "telegram_outbox_store": "telegram_outbox",
+    "sweep_checkpoints": "sweep_checkpoints",
+    "telegram_offsets": "telegram_offsets",
+    "list_views_store": "list_views",
+    "notifier_state": "notifier_state",
+    "digests": "digests",
+    "tracking_removals": "tracking_removals",
+}
+
+class MongoCounter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+
+    def add(self, name: str):
+        with self.lock:
+            self.ops[name] = self.ops.get(name, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.ops = {}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.ops)
+
+class CountingCollection:
+    def __init__(self, collection, counter: MongoCounter):
+        self.collection = collection
+        self.counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name not in MONGO_OPS or not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.counter.add(f"{self.collection.name}.{name}")
+            return attr(*args, **kwargs)
+
+        return counted
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test tracker.py against local Parcels/Telegram/Mongo stand-ins")
+    parser.add_argument("--parcels", type=int, default=1000, help="tracked parcels to seed")
+    parser.add_argument("--chats", type=int, default=200, help="distinct chats subscribed to the parcels")
+    parser.add_argument("--subs-per-parcel", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--parcels-latency", type=float, default=0.05, help="mean seconds per Parcels request")
+    parser.add_argument("--parcels-polls", type=int, default=1, help="GET polls before a lookup is done")
+    parser.add_argument("--parcels-errors", type=float, default=0.0, help="fraction of Parcels 500s")
+    parser.add_argument("--parcels-429", type=float, default=0.0, help="fraction of Parcels 429s")
+    parser.add_argument("--change-rate", type=float, default=0.2, help="fraction of parcels with a new event between sweeps")
+    parser.add_argument("--telegram-latency", type=float, default=0.01)
+    parser.add_argument("--telegram-errors", type=float, default=0.0)
+    parser.add_argument("--telegram-429", type=float, default=0.0)
+    parser.add_argument("--webhook-requests", type=int, default=500)
+    parser.add_argument("--ingestion", choices=("webhook", "polling"), default="webhook", help="how bot commands reach tracker.py")
+    parser.add_argument("--transport", choices=("requests", "httpx"), default="requests", help="HTTP client used by tracker.py")
+    parser.add_argument("--tracking-index", action="store_true", help="plan sweeps from the in-memory tracking index")
+    parser.add_argument("--mongo-url", default=os.environ.get("BENCH_MONGO_URL"), help="use a real mongod instead of mongomock")
+    parser.add_argument("--mongo-db", default="trackbot_bench")
+    parser.add_argument("--json", dest="json_out", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare against a report written with --json")
+    parser.add_argument("--verbose", action="store_true", help="show tracker.py output")
+    return parser.parse_args()
+
+def configure_env(args, parcels_url: str, telegram_url: str):
+    os.environ.update(
+        {
+            "PARCELS_TRACKING_URL": f"{parcels_url}/api/v3/shipments/tracking",
+            "TELEGRAM_API_URL": telegram_url,
+            "PARCELS_API_KEY": "bench",
+            "TELEGRAM_TOKEN": "bench",
+            "PARCELS_BATCH_SIZE": str(args.batch_size),
+            "REFRESH_CONCURRENCY": str(args.concurrency),
+            "PARCELS_RATE_PER_SEC": "0",
+            "TELEGRAM_RATE_PER_SEC": "0",
+            "TELEGRAM_CHAT_INTERVAL": "0",
+            "PARCELS_POLL_BASE_DELAY": "0.05",
+            "PARCELS_POLL_DEADLINE": "60",
+            "INSTANCE_ID": "bench",
+            "HTTP_TRANSPORT": args.transport,
+            "TELEGRAM_INGESTION": args.ingestion,
+            "TRACKING_INDEX": "1" if args.tracking_index else "",
+            "TRACKING_INDEX_SNAPSHOT": "",
+            "TELEGRAM_POLL_TIMEOUT": "1",
+            "NOTIFIER_POLL_INTERVAL": "0.2",
+            "LOG_LEVEL": "DEBUG" if args.verbose else "WARNING",
+        }
+    )
+
+def open_database(args):
+    if args.mongo_url:
+        from pymongo import MongoClient
+
+        client = MongoClient(args.mongo_url)
+        client.drop_database(args.mongo_db)
+        return client[args.mongo_db]
+
+    import mongomock
+
+    return mongomock.MongoClient()[args.mongo_db]
+
+def install_database(tracker, database, counter: MongoCounter):
+    tracker.db = database
+    for attr, name in TRACKER_COLLECTIONS.items():
+        if hasattr(tracker, attr):
+            setattr(tracker, attr, CountingCollection(database[name], counter))
+
+    if tracker.parcels_cache.store is not None:
+        tracker.parcels_cache.store = tracker.parcels_cache_store
+    if tracker.telegram_outbox.store is not None:
+        tracker.telegram_outbox.store = tracker.telegram_outbox_store
+    if tracker.list_views.store is not None:
+        tracker.list_views.store = tracker.list_views_store
+
+def seed(tracker, args):
+    now = datetime.utcnow()
+    tracks = []
+    subs = []
+
+    for i in range(args.parcels):
+        track_no = f"BENCH{i:08d}"
+        tracks.append({"track_no": track_no, "created_at": now})
+        for j in range(args.subs_per_parcel):
+            subs.append({"chat_id": 1000 + (i + j) % max(1, args.chats), "track_no": track_no, "created_at": now})
+
+    for i in range(0, len(tracks), 5000):
+        tracker.trackings.collection.insert_many(tracks[i:i + 5000])
+    seen = set()
+    unique_subs = []
+    for s in subs:
+        key = (s["chat_id"], s["track_no"])
+        if key not in seen:
+            seen.add(key)
+            unique_subs.append(s)
+    for i in range(0, len(unique_subs), 5000):
+        tracker.subscriptions.collection.insert_many(unique_subs[i:i + 5000])
+
+def delivery_pending(tracker) -> bool:
+    notices = tracker.trackings.collection.count_documents(
+        {"$or": [{"notice_at": {"$exists": True}}, {"notice_claim": {"$exists": True}}]}
+    )
+    return notices > 0 or tracker.telegram_outbox.pending() > 0
+
+def wait_for_outbox(tracker, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not delivery_pending(tracker):
+            time.sleep(0.2)
+            if not delivery_pending(tracker):
+                return
+        time.sleep(0.05)
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def measure_sweep(tracker, parcels: FakeParcels, telegram: FakeTelegram, counter: MongoCounter, n: int) -> dict:
+    parcels.reset()
+    telegram.reset()
+    counter.reset()
+
+    started = time.perf_counter()
+    claimed = tracker.run_refresh_sweep()
+    sweep_seconds = time.perf_counter() - started
+
+    wait_for_outbox(tracker)
+    total_seconds = time.perf_counter() - started
+
+    p = parcels.snapshot()
+    t = telegram.snapshot()
+    m = counter.snapshot()
+    api_calls = p.get("post", 0) + p.get("get", 0)
+    mongo_calls = sum(m.values())
+
+    return {
+        "parcels": n,
+        "claimed": claimed,
+        "sweep_seconds": round(sweep_seconds, 3),
+        "sweep_with_delivery_seconds": round(total_seconds, 3),
+        "parcels_per_second": round(n / sweep_seconds, 1) if sweep_seconds else 0.0,
+        "parcels_api_calls": api_calls,
+        "parcels_api_calls_per_parcel": round(api_calls / n, 3) if n else 0.0,
+        "parcels_errors": p.get("errors", 0) + p.get("throttled", 0),
+        "telegram_sends": t.get("send", 0),
+        "telegram_delivered": t.get("delivered", 0),
+        "mongo_round_trips": mongo_calls,
+        "mongo_round_trips_per_parcel": round(mongo_calls / n, 3) if n else 0.0,
+        "mongo_ops": m,
+    }
+
+def bench_messages(args):
+    commands = ["/list", "/start", "/info BENCH{:08d}", "/track BENCH{:08d}"]
+    for i in range(args.webhook_requests):
+        chat_id = 1000 + i % max(1, args.chats)
+        text = commands[i % len(commands)].format(i % max(1, args.parcels))
+        yield {"text": text, "chat": {"id": chat_id}, "from": {"username": "bench"}}
+
+def wait_for_polled(telegram: FakeTelegram, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with telegram.lock:
+            if not telegram.updates:
+                return
+        time.sleep(0.05)
+
+def measure_webhook(tracker, args, telegram: FakeTelegram, counter: MongoCounter) -> dict:
+    client = tracker.app.test_client()
+    latencies = []
+    counter.reset()
+
+    started = time.perf_counter()
+    if args.ingestion == "polling":
+        for message in bench_messages(args):
+            telegram.push_update(message)
+        tracker.start_update_poller()
+        wait_for_polled(telegram)
+    else:
+        for i, message in enumerate(bench_messages(args)):
+            t0 = time.perf_counter()
+            client.post("/telegram-webhook", json={"update_id": 10_000_000 + i, "message": message})
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    tracker.update_dispatcher.join()
+    drain_seconds = time.perf_counter() - started
+    wait_for_outbox(tracker)
+
+    return {
+        "requests": args.webhook_requests,
+        "ack_p50_ms": round(percentile(latencies, 50), 3),
+        "ack_p99_ms": round(percentile(latencies, 99), 3),
+        "ack_mean_ms": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        "processed_seconds": round(drain_seconds, 3),
+        "mongo_round_trips": sum(counter.snapshot().values()),
+    }
+
+def compare(report: dict, baseline: dict):
+    print("\nChange vs baseline:")
+    for section in ("cold_sweep", "change_sweep", "webhook"):
+        for key, value in report.get(section, {}).items():
+            old = baseline.get(section, {}).get(key)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)):
+                continue
+            delta = (value - old) / old * 100 if old else 0.0
+            print(f"  {section}.{key}: {old} -> {value} ({delta:+.1f}%)")
+
+def print_report(report: dict):
+    for section in ("cold_sweep", "change_sweep", "webhook"):
+        print(f"\n[{section}]")
+        for key, value in report[section].items():
+            if key == "mongo_ops":
+                continue
+            print(f"  {key}: {value}")
+
+def main():
+    args = parse_args()
+
+    parcels = FakeParcels(
+        polls_until_done=args.parcels_polls,
+        change_rate=args.change_rate,
+        latency=args.parcels_latency,
+        error_rate=args.parcels_errors,
+        throttle_rate=args.parcels_429,
+    )
+    telegram = FakeTelegram(
+        latency=args.telegram_latency,
+        error_rate=args.telegram_errors,
+        throttle_rate=args.telegram_429,
+    )
+    configure_env(args, parcels.start(), telegram.start())
+
+    import tracker
+
+    counter = MongoCounter()
+    install_database(tracker, open_database(args), counter)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with output:
+        tracker.ensure_indexes()
+        seed(tracker, args)
+        tracker.start_telegram_senders()
+        tracker.start_notifier()
+        tracker.start_update_workers()
+
+        cold = measure_sweep(tracker, parcels, telegram, counter, args.parcels)
+
+        parcels.next_generation()
+        tracker.trackings.collection.update_many({}, {"$set": {"next_check_at": datetime.utcnow(), "updated_at": datetime.utcnow()}})
+        change = measure_sweep(tracker, parcels, telegram, counter, args.parcels)
+
+        webhook = measure_webhook(tracker, args, telegram, counter)
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json_out", "baseline", "verbose")},
+        "cold_sweep": cold,
+        "change_sweep": change,
+        "webhook": webhook,
+    }
+
+    print_report(report)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    parcels.stop()
+    telegram.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import pytest
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    import tracker
+
+    def patch(*names):
+        database = mongomock.MongoClient().db
+        for name in names:
+            monkeypatch.setattr(tracker, name, database[name])
+        return database
+
+    return patch
@@ -0,0 +1,175 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+
+import tracker
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    perf_counter = monotonic
+    time = monotonic
+
+    def sleep(self, seconds: float):
+        self.now += max(0.0, seconds)
+
+class FakeParcels:
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.latency = 0.1
+        self.status = 200
+        self.calls = 0
+
+    def request(self, endpoint: str, method: str, url: str, **kwargs):
+        self.calls += 1
+        self.clock.now += self.latency
+        body = {"done": True, "shipments": []}
+        return tracker.TransportResponse(self.status, json.dumps(body).encode(), {})
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tracker, "time", clock)
+    return clock
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    breaker = tracker.CircuitBreaker("parcels", 0.5, 10, 5.0, 60.0)
+    monkeypatch.setattr(tracker, "parcels_breaker", breaker)
+    return breaker
+
+@pytest.fixture
+def parcels(monkeypatch, clock, breaker):
+    parcels = FakeParcels(clock)
+    monkeypatch.setattr(tracker, "transport", parcels)
+    monkeypatch.setattr(tracker, "parcels_limiter", tracker.TokenBucket(0))
+    monkeypatch.setattr(tracker, "parcels_cache", tracker.ParcelsCache(60, 100))
+    monkeypatch.setattr(tracker, "PARCELS_API_KEY", "test")
+    return parcels
+
+@pytest.fixture
+def sent(monkeypatch):
+    sent = []
+    monkeypatch.setattr(tracker, "send_telegram", lambda chat_id, text: sent.append((chat_id, text)))
+    monkeypatch.setattr(tracker, "telegram_call", lambda method, payload: {})
+    return sent
+
+def record(breaker, ok: bool, elapsed: float = 0.1):
+    breaker.record(breaker.before_call(), ok, elapsed)
+
+def trip(breaker):
+    for _ in range(tracker.CIRCUIT_MIN_CALLS):
+        record(breaker, False)
+    assert breaker.state == "open"
+
+def test_opens_on_failure_rate_and_closes_after_a_good_probe(breaker, clock):
+    for _ in range(tracker.CIRCUIT_MIN_CALLS - 1):
+        record(breaker, False)
+    assert breaker.state == "closed"
+
+    record(breaker, False)
+    assert breaker.state == "open"
+    with pytest.raises(tracker.CircuitOpenError):
+        breaker.before_call()
+    assert breaker.retry_in() == pytest.approx(60.0)
+
+    clock.now += 60.0
+    probe = breaker.before_call()
+    assert probe is True
+    assert breaker.state == "half_open"
+    with pytest.raises(tracker.CircuitOpenError):
+        breaker.before_call()
+    assert breaker.retry_in() == tracker.CIRCUIT_PROBE_WAIT
+
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+def test_failures_below_the_rate_keep_the_circuit_closed(breaker):
+    for i in range(10):
+        record(breaker, i % 3 != 0)
+    assert breaker.state == "closed"
+
+def test_failed_probe_doubles_open_time_up_to_the_cap(breaker, clock):
+    trip(breaker)
+
+    open_times = []
+    for _ in range(6):
+        clock.now += breaker.open_for
+        record(breaker, False)
+        open_times.append(breaker.open_for)
+
+    assert open_times == [120.0, 240.0, 480.0, 900.0, 900.0, 900.0]
+    assert breaker.retry_in() == pytest.approx(900.0)
+
+    clock.now += breaker.open_for
+    record(breaker, True)
+    assert breaker.state == "closed"
+    assert breaker.open_for == 60.0
+
+def test_slow_calls_open_the_circuit(parcels, breaker):
+    parcels.latency = 6.0
+    for _ in range(tracker.CIRCUIT_MIN_CALLS):
+        assert tracker.parcels_request("POST").status_code == 200
+    assert breaker.state == "open"
+
+    with pytest.raises(tracker.CircuitOpenError):
+        tracker.parcels_request("POST")
+    assert parcels.calls == tracker.CIRCUIT_MIN_CALLS
+
+def test_server_errors_open_the_circuit(parcels, breaker):
+    parcels.status = 503
+    for _ in range(tracker.CIRCUIT_MIN_CALLS):
+        tracker.parcels_request("POST")
+    assert breaker.state == "open"
+
+def test_refresh_chunk_is_deferred_while_circuit_is_open(monkeypatch, parcels, breaker):
+    trip(breaker)
+    deferred = []
+    released = []
+    monkeypatch.setattr(tracker.tracking_index, "defer", deferred.append)
+    monkeypatch.setattr(tracker, "release_lease", released.append)
+
+    done = Future()
+    tracker.begin_chunk_refresh(["T1", "T2"], "token", done)
+
+    assert done.result(timeout=5) is None
+    assert deferred == [["T1", "T2"]]
+    assert released == ["token"]
+    assert parcels.calls == 0
+
+def test_info_falls_back_to_stored_data(mongo_db, parcels, breaker, sent):
+    db = mongo_db("trackings", "subscriptions", "users")
+    db.trackings.insert_one(
+        {
+            "track_no": "AB123456789UA",
+            "last_status": "In transit",
+            "time_str": "2026-10-01 13:00",
+            "states": [{"date": "2026-10-01T10:00:00Z", "status": "In transit", "location": "Kyiv"}],
+        }
+    )
+    trip(breaker)
+
+    tracker.handle_update({"message": {"text": "/info AB123456789UA refresh", "chat": {"id": 1}, "from": {"id": 1}}})
+
+    assert sent[0] == (1, "⚠️ Parcels зараз недоступний, показую збережені дані.")
+    assert len(sent) > 1 and "In transit" in sent[1][1]
+    assert parcels.calls == 0
+
+def test_bulk_track_lists_numbers_as_unavailable(mongo_db, parcels, breaker, sent):
+    mongo_db("trackings", "subscriptions", "users")
+    tracker.parcels_cache.put("AA1", {"shipments": [{"trackingId": "AA1", "states": []}]}, persist=False)
+    trip(breaker)
+
+    tracker.track_many(1, {"id": 1}, ["AA1", "AA2", "AA3"])
+
+    text = "\n".join(text for _, text in sent)
+    added, unavailable = text.split("⚠️ Parcels зараз недоступний")
+    assert "AA1" in added and "AA2" not in added
+    assert "AA2" in unavailable and "AA3" in unavailable
+    assert parcels.calls == 0
@@ -0,0 +1,44 @@
+import tracker
+
+def event(status, date="2026-10-01T10:00:00Z", location="Kyiv"):
+    return {"date": date, "status": status, "location": location}
+
+def stored_tracking(states):
+    return {
+        "last_status": states[-1]["status"],
+        "states": states,
+        "event_fps": tracker.event_fingerprints(states),
+        "event_fps_version": tracker.EVENT_FINGERPRINT_VERSION,
+    }
+
+def test_events_with_same_date_and_location_are_kept_apart_by_position():
+    merged = tracker.merge_states([], [event("Arrived at sorting center"), event("Departed from sorting center")])
+
+    assert [ev["status"] for ev in merged] == ["Arrived at sorting center", "Departed from sorting center"]
+
+def test_reworded_status_is_not_a_new_event():
+    old = stored_tracking([event("Arrived at facility")])
+    data = {"shipments": [{"states": [event("Arrived at the sorting facility")]}]}
+
+    op, notice, _, fields = tracker.plan_tracking_update("T1", data, old)
+
+    assert notice is None
+    assert "$push" not in op._doc
+    assert [ev["status"] for ev in fields["states"]] == ["Arrived at the sorting facility"]
+
+def test_second_event_at_same_date_and_location_is_notified():
+    old = stored_tracking([event("Arrived at sorting center")])
+    data = {"shipments": [{"states": [event("Arrived at sorting center"), event("Departed from sorting center")]}]}
+
+    op, notice, _, fields = tracker.plan_tracking_update("T1", data, old)
+
+    assert notice is not None
+    assert len(op._doc["$push"]["pending_notices"]["text"]) > 0
+    assert len(fields["states"]) == 2
+
+def test_fingerprints_of_older_version_are_recomputed_from_states():
+    states = [event("Arrived at sorting center")]
+    expected = set(tracker.event_fingerprints(states))
+
+    assert tracker.stored_fingerprints({"states": states, "event_fps": ["stale"], "event_fps_version": 2}) == expected
+    assert tracker.stored_fingerprints({"states": states, "event_fps": ["stale"]}) == expected
@@ -0,0 +1,139 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("mongomock")
+
+import tracker
+
+@pytest.fixture
+def db(monkeypatch, mongo_db):
+    database = mongo_db("trackings", "subscriptions", "users", "digests")
+
+    sent = []
+    monkeypatch.setattr(tracker, "send_telegram", lambda chat_id, text: sent.append((chat_id, text)))
+    database.sent = sent
+    return database
+
+def add_notice(db, track_no: str, notice_id: str):
+    db.trackings.update_one(
+        {"track_no": track_no},
+        {
+            "$set": {"notice_at": datetime.utcnow()},
+            "$push": {"pending_notices": {"id": notice_id, "text": f"update {notice_id}", "at": datetime.utcnow()}},
+        },
+        upsert=True,
+    )
+
+def test_notices_are_delivered_once(db):
+    db.subscriptions.insert_many([{"chat_id": 1, "track_no": "T1"}, {"chat_id": 2, "track_no": "T1"}])
+    add_notice(db, "T1", "n1")
+
+    assert tracker.scan_pending_notices() == 1
+    assert sorted(db.sent) == [(1, "update n1"), (2, "update n1")]
+
+    tr = db.trackings.find_one({"track_no": "T1"})
+    assert tr["pending_notices"] == []
+    assert "notice_at" not in tr and "notice_claim" not in tr
+
+    assert tracker.scan_pending_notices() == 0
+    assert len(db.sent) == 2
+
+def test_failed_delivery_keeps_notices_pending(db, monkeypatch):
+    db.subscriptions.insert_one({"chat_id": 1, "track_no": "T1"})
+    add_notice(db, "T1", "n1")
+
+    find = db.subscriptions.find
+    calls = []
+
+    def failing_find(*args, **kwargs):
+        if not calls:
+            calls.append(1)
+            raise RuntimeError("boom")
+        return find(*args, **kwargs)
+
+    monkeypatch.setattr(db.subscriptions, "find", failing_find)
+
+    with pytest.raises(RuntimeError):
+        tracker.scan_pending_notices()
+
+    tr = db.trackings.find_one({"track_no": "T1"})
+    assert [n["id"] for n in tr["pending_notices"]] == ["n1"]
+    assert "notice_at" in tr and "notice_claim" not in tr
+
+    assert tracker.scan_pending_notices() == 1
+    assert db.sent == [(1, "update n1")]
+
+def test_stale_claims_are_retried(db):
+    db.subscriptions.insert_one({"chat_id": 1, "track_no": "T1"})
+    db.trackings.insert_one(
+        {
+            "track_no": "T1",
+            "pending_notices": [{"id": "n1", "text": "update n1", "at": datetime.utcnow()}],
+            "notice_claim": "crashed",
+            "notice_claim_at": datetime.utcnow() - tracker.NOTIFIER_CLAIM_TIMEOUT * 2,
+        }
+    )
+
+    assert tracker.scan_pending_notices() == 1
+    assert db.sent == [(1, "update n1")]
+
+def enable_digest(db, chat_id: int, minutes: int = 30):
+    db.users.insert_one({"chat_id": chat_id, "digest_minutes": minutes})
+
+def command(chat_id: int, text: str):
+    tracker.handle_update({"message": {"text": text, "chat": {"id": chat_id}, "from": {"id": chat_id}}})
+
+def test_digest_keeps_only_latest_notice_per_parcel():
+    chunks = tracker.render_digest(
+        [
+            {"track_no": "T1", "text": "T1 first"},
+            {"track_no": "T2", "text": "T2 only"},
+            {"track_no": "T1", "text": "T1 second"},
+        ]
+    )
+
+    assert len(chunks) == 1
+    assert "2 посилки" in chunks[0]
+    assert "T1 first" not in chunks[0]
+    assert chunks[0].index("T2 only") < chunks[0].index("T1 second")
+
+def test_digest_is_split_at_telegram_message_limit():
+    items = [{"track_no": f"T{i}", "text": f"T{i} " + "x" * 1000} for i in range(10)]
+
+    chunks = tracker.render_digest(items)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= tracker.TELEGRAM_MESSAGE_LIMIT for chunk in chunks)
+    assert all(f"T{i} " in "".join(chunks) for i in range(10))
+
+def test_notice_is_split_between_digest_and_direct_chats(db):
+    db.subscriptions.insert_many([{"chat_id": 1, "track_no": "T1"}, {"chat_id": 2, "track_no": "T1"}])
+    enable_digest(db, 2)
+    add_notice(db, "T1", "n1")
+
+    assert tracker.scan_pending_notices() == 1
+    assert db.sent == [(1, "update n1")]
+
+    digest = db.digests.find_one({"_id": 2})
+    assert [item["text"] for item in digest["items"]] == ["update n1"]
+    assert db.trackings.find_one({"track_no": "T1"})["pending_notices"] == []
+
+    assert tracker.flush_due_digests() == 0
+    assert tracker.flush_due_digests(digest["due_at"]) == 1
+    assert db.sent[1][0] == 2 and "update n1" in db.sent[1][1]
+    assert db.digests.count_documents({}) == 0
+
+def test_digest_off_flushes_pending_digest(db):
+    db.subscriptions.insert_one({"chat_id": 1, "track_no": "T1"})
+    enable_digest(db, 1)
+    add_notice(db, "T1", "n1")
+    tracker.scan_pending_notices()
+    assert db.sent == []
+
+    command(1, "/digest off")
+
+    assert "update n1" in db.sent[0][1]
+    assert "Зведення вимкнене" in db.sent[1][1]
+    assert db.digests.count_documents({}) == 0
+    assert db.users.find_one({"chat_id": 1})["digest_minutes"] == 0
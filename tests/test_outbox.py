@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import tracker
+
+@pytest.fixture
+def store():
+    return mongomock.MongoClient().db.telegram_outbox
+
+def outbox_for(monkeypatch, store, instance_id: str):
+    monkeypatch.setattr(tracker, "INSTANCE_ID", instance_id)
+    return tracker.TelegramOutbox(0, store=store, lease_seconds=60)
+
+def test_restore_skips_messages_of_live_instances(monkeypatch, store):
+    live = outbox_for(monkeypatch, store, "live")
+    live.put(1, "from live")
+
+    restarted = outbox_for(monkeypatch, store, "restarted")
+    restarted.restore()
+
+    assert restarted.pending() == 0
+    assert store.find_one({"text": "from live"})["owner"] == "live"
+
+def test_restore_takes_own_and_expired_messages(monkeypatch, store):
+    outbox_for(monkeypatch, store, "me").put(1, "mine")
+    outbox_for(monkeypatch, store, "crashed").put(2, "orphaned")
+    store.update_one({"text": "orphaned"}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}})
+    store.insert_one({"chat_id": 3, "text": "legacy", "attempts": 0, "created_at": datetime.utcnow()})
+
+    restarted = outbox_for(monkeypatch, store, "me")
+    restarted.restore()
+
+    assert restarted.pending() == 3
+    assert {doc["owner"] for doc in store.find()} == {"me"}
+
+    restarted.renew()
+    assert restarted.pending() == 3
@@ -0,0 +1,38 @@
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+import tracker
+
+class RecordingStore:
+    def __init__(self):
+        self.collection = mongomock.MongoClient().db.parcels_cache
+        self.bulk_writes = []
+
+    def bulk_write(self, requests, ordered=True):
+        self.bulk_writes.append((len(requests), ordered))
+        for request in requests:
+            self.collection.replace_one(request._filter, request._doc, upsert=True)
+
+    def replace_one(self, *args, **kwargs):
+        raise AssertionError("put_many must not write per parcel")
+
+def test_put_many_writes_all_parcels_in_one_bulk():
+    store = RecordingStore()
+    cache = tracker.ParcelsCache(60, 10, store=store)
+
+    cache.put_many({"AA1": {"shipments": [1]}, "AA2": {"shipments": [2]}, "AA3": None})
+
+    assert store.bulk_writes == [(2, False)]
+    assert {doc["_id"] for doc in store.collection.find()} == {"AA1", "AA2"}
+    assert set(cache.entries) == {"AA1", "AA2"}
+
+def test_store_chunk_results_batches_cache_writes(monkeypatch):
+    store = RecordingStore()
+    monkeypatch.setattr(tracker, "parcels_cache", tracker.ParcelsCache(60, 10, store=store))
+    monkeypatch.setattr(tracker, "trackings", mongomock.MongoClient().db.trackings)
+
+    shipments = {tn: {"trackingNumber": tn, "states": []} for tn in ("AA1", "AA2", "AA3")}
+    tracker.store_chunk_results(list(shipments) + ["AA4"], shipments)
+
+    assert store.bulk_writes == [(3, False)]
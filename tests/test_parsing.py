@@ -0,0 +1,42 @@
+import pytest
+
+import tracker
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("RR123456789UA", ["RR123456789UA"]),
+        ("RR123456789UA RR123456789UA", ["RR123456789UA"]),
+        ("RR123456789UA note", ["RR123456789UA"]),
+        ("RR123456789UA, rr123456789ua; LP0042", ["RR123456789UA", "LP0042"]),
+        ("a\nb\n12-34\n", ["12-34"]),
+        ("", []),
+    ],
+)
+def test_parse_tracking_numbers(raw, expected):
+    assert tracker.parse_tracking_numbers(raw) == expected
+
+@pytest.mark.parametrize(
+    "text, looked_up",
+    [
+        ("/track RR123456789UA RR123456789UA", "RR123456789UA"),
+        ("/track RR123456789UA note", "RR123456789UA"),
+    ],
+)
+def test_single_track_uses_parsed_number(monkeypatch, text, looked_up):
+    lookups = []
+
+    monkeypatch.setattr(tracker.tracking_index, "is_subscribed", lambda chat_id, track_no: False)
+    monkeypatch.setattr(tracker, "fetch_initial_status", lambda track_no, chat_id: lookups.append(track_no))
+    monkeypatch.setattr(tracker, "send_telegram", lambda chat_id, message: None)
+
+    tracker.handle_update({"message": {"text": text, "chat": {"id": 1}, "from": {}}})
+
+    assert lookups == [looked_up]
+
+def test_split_message_respects_limit():
+    parts = ["a" * 30, "b" * 30, "c" * 30]
+    chunks = tracker.split_message(parts, limit=70)
+
+    assert all(len(chunk) <= 70 for chunk in chunks)
+    assert "\n".join(chunks) == "\n".join(parts)
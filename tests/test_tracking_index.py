@@ -0,0 +1,89 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock")
+
+import tracker
+
+@pytest.fixture
+def index(monkeypatch, mongo_db):
+    database = mongo_db("trackings", "subscriptions", "tracking_removals")
+
+    index = tracker.TrackingIndex(True)
+    monkeypatch.setattr(tracker, "tracking_index", index)
+    index.database = database
+    return index
+
+def seed(database, n: int):
+    now = datetime.utcnow()
+    database.trackings.insert_many(
+        [
+            {"track_no": f"T{i}", "last_status": "In transit", "next_check_at": now - timedelta(minutes=1), "updated_at": now}
+            for i in range(n)
+        ]
+    )
+    database.subscriptions.insert_many(
+        [{"chat_id": i % 2, "track_no": f"T{i}", "created_at": now} for i in range(n)]
+    )
+
+def test_failed_chunk_is_requeued(index):
+    seed(index.database, 3)
+    index.sync()
+
+    token, chunk = tracker.claim_due_batch(10, datetime.utcnow())
+    assert sorted(chunk) == ["T0", "T1", "T2"]
+    assert index.due(datetime.utcnow(), 10) == []
+
+    lookup, done = Future(), Future()
+    lookup.set_exception(RuntimeError("parcels down"))
+    tracker.complete_chunk_refresh(chunk, token, lookup, done)
+
+    assert isinstance(done.exception(), RuntimeError)
+    index.requeue()
+    assert sorted(index.due(datetime.utcnow(), 10)) == ["T0", "T1", "T2"]
+
+def test_removals_elsewhere_are_caught_up_without_reload(index):
+    seed(index.database, 4)
+    index.sync()
+
+    other = tracker.TrackingIndex(True)
+    index.database.subscriptions.delete_one({"chat_id": 1, "track_no": "T1"})
+    index.database.trackings.delete_one({"track_no": "T1"})
+    other.forget(1, "T1", tracking_removed=True)
+    index.database.subscriptions.delete_one({"chat_id": 0, "track_no": "T2"})
+    other.forget(0, "T2", tracking_removed=False)
+    index.database.subscriptions.insert_one({"chat_id": 0, "track_no": "T2", "created_at": datetime.utcnow()})
+
+    index.sync()
+
+    assert index.full_loads == 1
+    assert "T1" not in index.records
+    assert index.is_subscribed(0, "T2") is True
+    assert index.subscribed_among(0, ["T0", "T2"]) == {"T0", "T2"}
+    assert index.stats()["subscriptions"] == 3
+
+def test_snapshot_round_trip(index, tmp_path):
+    seed(index.database, 5)
+    index.database.trackings.update_one({"track_no": "T4"}, {"$set": {"next_check_at": None, "last_status": "Доставлено"}})
+    index.sync()
+
+    index.snapshot_path = str(tmp_path / "index.snapshot")
+    index.save_snapshot()
+
+    loaded = tracker.TrackingIndex(True, index.snapshot_path)
+    assert loaded.load_snapshot()
+    assert loaded.stats()["parcels"] == 5
+    assert loaded.stats()["subscriptions"] == 5
+    assert loaded.records["T4"].status == "Доставлено"
+    assert loaded.records["T0"].status is loaded.records["T1"].status
+    assert list(loaded.records["T3"].subscribers) == [1]
+    assert sorted(loaded.due(datetime.utcnow(), 10)) == ["T0", "T1", "T2", "T3"]
+    assert loaded.synced_at == index.synced_at
+
+def test_unreadable_snapshot_is_ignored(tmp_path):
+    path = tmp_path / "index.snapshot"
+    path.write_bytes(b"\x80\x04not a snapshot")
+
+    assert not tracker.TrackingIndex(True, str(path)).load_snapshot()
@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracker
+
+def test_httpx_without_h2_falls_back_to_requests(monkeypatch):
+    monkeypatch.setattr(tracker, "HTTP_TRANSPORT", "httpx")
+    monkeypatch.setattr(tracker, "h2", None)
+
+    assert type(tracker.create_transport()) is tracker.HttpTransport
+
+def test_client_error_is_raised_instead_of_hanging(monkeypatch):
+    def broken_client(self):
+        raise ImportError("h2 is not installed")
+
+    monkeypatch.setattr(tracker.AsyncHttpTransport, "create_client", broken_client)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        future = pool.submit(tracker.AsyncHttpTransport, tracker.HTTP_ENDPOINTS, 2, 0.1, 5)
+        with pytest.raises(ImportError):
+            future.result(timeout=5)
+
+def test_failed_httpx_transport_falls_back_to_requests(monkeypatch):
+    pytest.importorskip("httpx")
+
+    def broken_client(self):
+        raise ImportError("h2 is not installed")
+
+    monkeypatch.setattr(tracker, "HTTP_TRANSPORT", "httpx")
+    monkeypatch.setattr(tracker, "h2", object())
+    monkeypatch.setattr(tracker.AsyncHttpTransport, "create_client", broken_client)
+
+    assert type(tracker.create_transport()) is tracker.HttpTransport
@@ -1,37 +1,686 @@
 import os
+import json
 import time
+import logging
 import random
 import html
+import hashlib
+import socket
+import uuid
+import asyncio
+import sys
+import math
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta, timezone
-from flask import request, jsonify, Flask
+from flask import request, jsonify, Flask, Response
 import threading
-from pymongo import MongoClient
+import queue
+import heapq
+import itertools
+import bisect
+import re
+from array import array
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pymongo import MongoClient, ReplaceOne, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import OperationFailure
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+try:
+    import uvicorn
+except ImportError:
+    uvicorn = None
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.1))
+SAMPLED = {"sampled": True}
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25)
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        if getattr(record, "sampled", False):
+            return random.random() < self.rate
+        return True
+
+logging.basicConfig(
+    level=LOG_LEVEL,
+    format="%(asctime)s %(levelname)s %(threadName)s %(message)s",
+)
+log = logging.getLogger("tracker")
+log.addFilter(SampleFilter(LOG_SAMPLE_RATE))
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+class Metrics:
+    def __init__(self, prefix: str, buckets: tuple):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def key(self, name: str, labels: dict) -> tuple:
+        return (self.prefix + name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        k = self.key(name, labels)
+        with self.lock:
+            self.counters[k] = self.counters.get(k, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        k = self.key(name, labels)
+        with self.lock:
+            self.gauges[k] = float(value)
+
+    def observe(self, name: str, value: float, **labels):
+        k = self.key(name, labels)
+        with self.lock:
+            hist = self.histograms.get(k)
+            if hist is None:
+                hist = self.histograms[k] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    @staticmethod
+    def format_labels(labels, extra: tuple = ()) -> str:
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    def render(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: ([*v[0]], v[1], v[2]) for k, v in self.histograms.items()}
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{self.format_labels(labels)} {value:g}")
+
+        for (name, labels), value in sorted(gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{name}{self.format_labels(labels)} {value:g}")
+
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            declare(name, "histogram")
+            for bound, n in zip(self.buckets, buckets):
+                lines.append(f"{name}_bucket{self.format_labels(labels, (('le', f'{bound:g}'),))} {n}")
+            lines.append(f"{name}_bucket{self.format_labels(labels, (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics("trackbot_", LATENCY_BUCKETS)
+
+class MongoMetricsListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        metrics.observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        metrics.observe("mongo_command_seconds", event.duration_micros / 1e6, command=event.command_name)
+        metrics.inc("mongo_command_errors_total", command=event.command_name)
 
 app = Flask(__name__)
 
-client = MongoClient(os.environ.get("MONGO_URL"))
+client = MongoClient(os.environ.get("MONGO_URL"), event_listeners=[MongoMetricsListener()])
 db = client["trackbot"]
 users = db.users
 trackings = db.trackings
 subscriptions = db.subscriptions
+parcels_cache_store = db.parcels_cache
+telegram_outbox_store = db.telegram_outbox
+sweep_checkpoints = db.sweep_checkpoints
+telegram_offsets = db.telegram_offsets
+list_views_store = db.list_views
+notifier_state = db.notifier_state
+digests = db.digests
+tracking_removals = db.tracking_removals
 
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
 PARCELS_API_KEY = os.environ.get("PARCELS_API_KEY")
 PARCELS_LANGUAGE = os.environ.get("PARCELS_LANGUAGE", "en")
 PARCELS_DESTINATION_COUNTRY = os.environ.get("PARCELS_DESTINATION_COUNTRY", "Ukraine")
 REFRESH_INTERVAL = 10 * 60
-PARCELS_TRACKING_URL = "https://parcelsapp.com/api/v3/shipments/tracking"
+PARCELS_TRACKING_URL = os.environ.get(
+    "PARCELS_TRACKING_URL", "https://parcelsapp.com/api/v3/shipments/tracking"
+)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org")
 KYIV_TZ = timezone(timedelta(hours=2))
 MAX_TRACK_NO_LENGTH = 64
+PARCELS_BATCH_SIZE = int(os.environ.get("PARCELS_BATCH_SIZE", 20))
+PARCELS_POLL_BASE_DELAY = float(os.environ.get("PARCELS_POLL_BASE_DELAY", 1.0))
+PARCELS_POLL_MAX_DELAY = float(os.environ.get("PARCELS_POLL_MAX_DELAY", 15.0))
+PARCELS_POLL_DEADLINE = float(os.environ.get("PARCELS_POLL_DEADLINE", 120.0))
+PARCELS_POLL_WORKERS = int(os.environ.get("PARCELS_POLL_WORKERS", 4))
+PARCELS_CIRCUIT_FAILURE_RATE = float(os.environ.get("PARCELS_CIRCUIT_FAILURE_RATE", 0.5))
+PARCELS_CIRCUIT_WINDOW = int(os.environ.get("PARCELS_CIRCUIT_WINDOW", 20))
+PARCELS_CIRCUIT_SLOW_SECONDS = float(os.environ.get("PARCELS_CIRCUIT_SLOW_SECONDS", 10))
+PARCELS_CIRCUIT_OPEN_SECONDS = float(os.environ.get("PARCELS_CIRCUIT_OPEN_SECONDS", 60))
+CIRCUIT_MIN_CALLS = 5
+CIRCUIT_MAX_OPEN_SECONDS = 15 * 60
+CIRCUIT_PROBE_WAIT = 1.0
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+REFRESH_CONCURRENCY = int(os.environ.get("REFRESH_CONCURRENCY", 8))
+NOTIFIER_MODE = os.environ.get("NOTIFIER_MODE", "auto").lower()
+NOTIFIER_BATCH_SIZE = int(os.environ.get("NOTIFIER_BATCH_SIZE", 100))
+NOTIFIER_POLL_INTERVAL = float(os.environ.get("NOTIFIER_POLL_INTERVAL", 2.0))
+NOTIFIER_CLAIM_TIMEOUT = timedelta(minutes=5)
+DIGEST_DEFAULT_MINUTES = int(os.environ.get("DIGEST_DEFAULT_MINUTES", 30))
+DIGEST_MAX_MINUTES = int(os.environ.get("DIGEST_MAX_MINUTES", 24 * 60))
+DIGEST_POLL_INTERVAL = float(os.environ.get("DIGEST_POLL_INTERVAL", 15.0))
+DIGEST_OFF_WORDS = ("off", "0", "вимкнути")
+DIGEST_ON_WORDS = ("on", "увімкнути")
+CHANGE_STREAM_UNSUPPORTED_CODES = (40573, 40324, 115)
+CHANGE_STREAM_HISTORY_LOST_CODES = (280, 286)
+REFRESH_LEASE_SECONDS = int(os.environ.get("REFRESH_LEASE_SECONDS", 5 * 60))
+INSTANCE_ID = os.environ.get("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}"
+PARCELS_RATE_PER_SEC = float(os.environ.get("PARCELS_RATE_PER_SEC", 5))
+TELEGRAM_RATE_PER_SEC = float(os.environ.get("TELEGRAM_RATE_PER_SEC", 25))
+TELEGRAM_CHAT_INTERVAL = float(os.environ.get("TELEGRAM_CHAT_INTERVAL", 1.0))
+TELEGRAM_SENDERS = int(os.environ.get("TELEGRAM_SENDERS", 2))
+TELEGRAM_MAX_ATTEMPTS = int(os.environ.get("TELEGRAM_MAX_ATTEMPTS", 5))
+TELEGRAM_OUTBOX_PERSIST = os.environ.get("TELEGRAM_OUTBOX_PERSIST", "").lower() in ("1", "true", "yes")
+TELEGRAM_OUTBOX_LEASE_SECONDS = int(os.environ.get("TELEGRAM_OUTBOX_LEASE_SECONDS", 120))
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", 1000))
+SEEN_UPDATES_LIMIT = 10000
+TELEGRAM_INGESTION = os.environ.get("TELEGRAM_INGESTION", "webhook").lower()
+TELEGRAM_POLL_TIMEOUT = int(os.environ.get("TELEGRAM_POLL_TIMEOUT", 25))
+TELEGRAM_POLL_LIMIT = int(os.environ.get("TELEGRAM_POLL_LIMIT", 100))
+TELEGRAM_POLL_LEASE_SECONDS = int(os.environ.get("TELEGRAM_POLL_LEASE_SECONDS", 60))
+RUNTIME = os.environ.get("RUNTIME", "threads").lower()
+SHUTDOWN_GRACE_SECONDS = float(os.environ.get("SHUTDOWN_GRACE_SECONDS", 10))
+INFO_REFRESH_WORDS = ("refresh", "оновити")
+TRACK_BULK_LIMIT = int(os.environ.get("TRACK_BULK_LIMIT", 50))
+TRACK_DOCUMENT_MAX_BYTES = int(os.environ.get("TRACK_DOCUMENT_MAX_BYTES", 64 * 1024))
+TRACK_DOCUMENT_TYPES = ("text/plain", "text/csv", "text/comma-separated-values")
+TRACK_NUMBER_SEPARATORS = re.compile(r"[\s,;]+")
+
+SCHEDULE_ACTIVE_INTERVAL = timedelta(minutes=30)
+SCHEDULE_IDLE_INTERVAL = timedelta(hours=3)
+SCHEDULE_STALE_INTERVAL = timedelta(hours=12)
+SCHEDULE_IDLE_AFTER = timedelta(days=3)
+SCHEDULE_STALE_AFTER = timedelta(days=14)
+SCHEDULE_EXPIRE_AFTER = timedelta(days=60)
+SCHEDULE_RETRY_INTERVAL = timedelta(minutes=10)
+FINAL_STAGES = ("delivered", "expired")
+EVENT_FINGERPRINT_VERSION = 3
+TRACKING_STATE_FIELDS = {
+    "track_no": 1,
+    "last_status": 1,
+    "states": 1,
+    "event_fps": 1,
+    "event_fps_version": 1,
+    "last_change_at": 1,
+    "last_update": 1,
+    "created_at": 1,
+}
+LIST_ENTRY_FIELDS = {
+    "track_no": 1,
+    "last_status": 1,
+    "time_str": 1,
+    "origin": 1,
+    "origin_code": 1,
+    "destination": 1,
+    "destination_code": 1,
+}
+STAGE_STATUS_CODES = {
+    "delivered": "delivered",
+    "archive": "expired",
+    "expired": "expired",
+    "pickup": "out_for_delivery",
+}
+STAGE_KEYWORDS = [
+    ("delivered", ("delivered", "доставлено", "вручено", "отримано")),
+    ("expired", ("expired", "returned to sender", "повернуто відправнику")),
+    ("out_for_delivery", (
+        "out for delivery",
+        "with courier",
+        "ready for pickup",
+        "awaiting pickup",
+        "arrived at pickup",
+        "передано кур'єру",
+        "готове до видачі",
+    )),
+]
+PARCELS_CACHE_TTL = int(os.environ.get("PARCELS_CACHE_TTL", 5 * 60))
+PARCELS_CACHE_MAX_ENTRIES = int(os.environ.get("PARCELS_CACHE_MAX_ENTRIES", 5000))
+PARCELS_CACHE_PERSIST = os.environ.get("PARCELS_CACHE_PERSIST", "").lower() in ("1", "true", "yes")
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", 20))
+LIST_VIEW_TTL = int(os.environ.get("LIST_VIEW_TTL", 5 * 60))
+LIST_VIEW_MAX_CHATS = int(os.environ.get("LIST_VIEW_MAX_CHATS", 2000))
+LIST_VIEW_PERSIST = os.environ.get("LIST_VIEW_PERSIST", "").lower() in ("1", "true", "yes")
+LIST_VIEW_STORE_TTL = int(os.environ.get("LIST_VIEW_STORE_TTL", 24 * 60 * 60))
+TRACKING_INDEX = os.environ.get("TRACKING_INDEX", "").lower() in ("1", "true", "yes")
+TRACKING_INDEX_SNAPSHOT = os.environ.get("TRACKING_INDEX_SNAPSHOT", "tracking_index.snapshot")
+TRACKING_INDEX_OVERLAP = timedelta(seconds=60)
+TRACKING_INDEX_TOMBSTONE_TTL = timedelta(days=7)
+TRACKING_INDEX_SNAPSHOT_VERSION = 2
+TRACKING_INDEX_FIELDS = {"_id": 0, "track_no": 1, "last_status": 1, "next_check_at": 1, "updated_at": 1}
+UNIX_EPOCH = datetime(1970, 1, 1)
 
 EMOJI_THEMES = [
     {"header": "🔔", "pin": "📍", "route": "✈️", "time": "🕒"},
     {"header": "🆙", "pin": "📌", "route": "🛳️", "time": "⏱️"},
     {"header": "📣", "pin": "🚩", "route": "🚚", "time": "🕰️"},
 ]
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+HTTP_TRANSPORT = os.environ.get("HTTP_TRANSPORT", "requests").lower()
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", max(10, REFRESH_CONCURRENCY * 2 + TELEGRAM_SENDERS + WEBHOOK_WORKERS)))
+HTTP_KEEPALIVE_SECONDS = float(os.environ.get("HTTP_KEEPALIVE_SECONDS", 30))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", 0.5))
+HTTP_ENDPOINTS = {
+    "parcels": {
+        "connect_timeout": 5.0,
+        "read_timeout": float(os.environ.get("PARCELS_TIMEOUT", 25)),
+        "retries": int(os.environ.get("PARCELS_RETRIES", 2)),
+        "retry_statuses": (500, 502, 503, 504),
+        "retry_timeouts": True,
+    },
+    "telegram": {
+        "connect_timeout": 5.0,
+        "read_timeout": float(os.environ.get("TELEGRAM_TIMEOUT", 10)),
+        "retries": 1,
+        "retry_statuses": (),
+        "retry_timeouts": False,
+    },
+    "telegram_poll": {
+        "connect_timeout": 5.0,
+        "read_timeout": TELEGRAM_POLL_TIMEOUT + 10.0,
+        "retries": 0,
+        "retry_statuses": (),
+        "retry_timeouts": False,
+    },
+    "telegram_file": {
+        "connect_timeout": 5.0,
+        "read_timeout": 20.0,
+        "retries": 2,
+        "retry_statuses": (500, 502, 503, 504),
+        "retry_timeouts": True,
+    },
+}
+
+class TransportResponse:
+    def __init__(self, status_code: int, content: bytes, headers: dict):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+class TransportError(Exception):
+    def __init__(self, kind: str, error: Exception):
+        super().__init__(f"{kind}: {error}")
+        self.kind = kind
+        self.error = error
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} circuit is open, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+class HttpTransport:
+    name = "requests"
+
+    def __init__(self, endpoints: dict, pool_size: int, retry_backoff: float):
+        self.endpoints = endpoints
+        self.retry_backoff = retry_backoff
+        self.session = requests.Session()
+        for prefix in ("https://", "http://"):
+            self.session.mount(
+                prefix,
+                HTTPAdapter(pool_connections=len(endpoints), pool_maxsize=pool_size),
+            )
+
+    def send(self, endpoint: str, method: str, url: str, **kwargs) -> TransportResponse:
+        config = self.endpoints[endpoint]
+        try:
+            resp = self.session.request(
+                method,
+                url,
+                timeout=(config["connect_timeout"], config["read_timeout"]),
+                **kwargs,
+            )
+        except (requests.ConnectionError, requests.ConnectTimeout) as e:
+            raise TransportError("connect", e)
+        except requests.Timeout as e:
+            raise TransportError("timeout", e)
+
+        return TransportResponse(resp.status_code, resp.content, dict(resp.headers))
+
+    def retry_delay(self, attempt: int) -> float:
+        return self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def should_retry(self, endpoint: str, attempt: int, resp=None, error=None) -> bool:
+        config = self.endpoints[endpoint]
+        if attempt >= config["retries"]:
+            return False
+
+        if error is not None:
+            retry = error.kind == "connect" or (error.kind == "timeout" and config["retry_timeouts"])
+        else:
+            retry = resp.status_code in config["retry_statuses"]
+
+        if retry:
+            metrics.inc("http_retries_total", endpoint=endpoint)
+        return retry
+
+    def request(self, endpoint: str, method: str, url: str, **kwargs) -> TransportResponse:
+        attempt = 0
+        while True:
+            try:
+                resp = self.send(endpoint, method, url, **kwargs)
+            except TransportError as e:
+                if not self.should_retry(endpoint, attempt, error=e):
+                    raise
+            else:
+                if not self.should_retry(endpoint, attempt, resp=resp):
+                    return resp
+
+            time.sleep(self.retry_delay(attempt))
+            attempt += 1
+
+class AsyncHttpTransport(HttpTransport):
+    name = "httpx"
+
+    def __init__(self, endpoints: dict, pool_size: int, retry_backoff: float, keepalive: float, loop=None):
+        self.endpoints = endpoints
+        self.retry_backoff = retry_backoff
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.client = None
+
+        if loop is not None:
+            self.loop = loop
+            self.client = self.create_client()
+            return
+
+        self.ready = threading.Event()
+        self.error = None
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.run, name="http-transport", daemon=True).start()
+        self.ready.wait()
+
+        if self.error is not None:
+            raise self.error
+
+    def create_client(self):
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size,
+                keepalive_expiry=self.keepalive,
+            ),
+        )
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.client = self.create_client()
+        except Exception as e:
+            self.error = e
+            self.loop.close()
+            return
+        finally:
+            self.ready.set()
+        self.loop.run_forever()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def asend(self, endpoint: str, method: str, url: str, **kwargs) -> TransportResponse:
+        config = self.endpoints[endpoint]
+        timeout = httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"])
+        try:
+            resp = await self.client.request(method, url, timeout=timeout, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            raise TransportError("connect", e)
+        except httpx.TimeoutException as e:
+            raise TransportError("timeout", e)
+
+        return TransportResponse(resp.status_code, resp.content, dict(resp.headers))
+
+    async def arequest(self, endpoint: str, method: str, url: str, **kwargs) -> TransportResponse:
+        attempt = 0
+        while True:
+            try:
+                resp = await self.asend(endpoint, method, url, **kwargs)
+            except TransportError as e:
+                if not self.should_retry(endpoint, attempt, error=e):
+                    raise
+            else:
+                if not self.should_retry(endpoint, attempt, resp=resp):
+                    return resp
+
+            await asyncio.sleep(self.retry_delay(attempt))
+            attempt += 1
+
+    def send(self, endpoint: str, method: str, url: str, **kwargs) -> TransportResponse:
+        return asyncio.run_coroutine_threadsafe(
+            self.asend(endpoint, method, url, **kwargs),
+            self.loop,
+        ).result()
+
+    def request(self, endpoint: str, method: str, url: str, **kwargs) -> TransportResponse:
+        return asyncio.run_coroutine_threadsafe(
+            self.arequest(endpoint, method, url, **kwargs),
+            self.loop,
+        ).result()
+
+def httpx_unavailable() -> str:
+    if httpx is None:
+        return "httpx is not installed"
+    if h2 is None:
+        return "httpx is installed without HTTP/2 support (pip install httpx[http2])"
+    return ""
+
+def create_transport():
+    if HTTP_TRANSPORT == "httpx":
+        reason = httpx_unavailable()
+        if reason:
+            log.warning("⚠️ HTTP_TRANSPORT=httpx but %s, using requests", reason)
+        else:
+            try:
+                return AsyncHttpTransport(HTTP_ENDPOINTS, HTTP_POOL_SIZE, HTTP_RETRY_BACKOFF, HTTP_KEEPALIVE_SECONDS)
+            except Exception as e:
+                log.warning("⚠️ httpx transport failed to start: %r, using requests", e)
+
+    return HttpTransport(HTTP_ENDPOINTS, HTTP_POOL_SIZE, HTTP_RETRY_BACKOFF)
+
+transport = create_transport()
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            wait = self.reserve(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0):
+        while True:
+            wait = self.reserve(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+parcels_limiter = TokenBucket(PARCELS_RATE_PER_SEC)
+telegram_limiter = TokenBucket(TELEGRAM_RATE_PER_SEC)
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_rate: float, window: int, slow_seconds: float, open_seconds: float, probes: int = 1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.open_seconds = open_seconds
+        self.probes = max(1, probes)
+        self.outcomes = deque(maxlen=max(1, window))
+        self.state = "closed"
+        self.open_for = open_seconds
+        self.opened_until = 0.0
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        self.lock = threading.Lock()
+        metrics.set("circuit_state", CIRCUIT_STATES["closed"], circuit=name)
+
+    def transition(self, state: str):
+        if state == self.state:
+            return
+
+        log.warning("🔌 %s circuit %s → %s", self.name, self.state, state)
+        self.state = state
+        metrics.set("circuit_state", CIRCUIT_STATES[state], circuit=self.name)
+        metrics.inc("circuit_transitions_total", circuit=self.name, state=state)
+
+    def trip(self, now: float):
+        self.opened_until = now + self.open_for
+        self.outcomes.clear()
+        self.transition("open")
+
+    def reject(self, retry_in: float):
+        metrics.inc("circuit_rejected_total", circuit=self.name)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def before_call(self) -> bool:
+        if self.failure_rate <= 0:
+            return False
+
+        with self.lock:
+            now = time.monotonic()
+
+            if self.state == "open":
+                if now < self.opened_until:
+                    self.reject(self.opened_until - now)
+                self.probe_successes = 0
+                self.transition("half_open")
+
+            if self.state == "half_open":
+                if self.probes_in_flight >= self.probes:
+                    self.reject(CIRCUIT_PROBE_WAIT)
+                self.probes_in_flight += 1
+                return True
+
+        return False
 
-session = requests.Session()
+    def record(self, probe: bool, ok: bool, elapsed: float):
+        if self.failure_rate <= 0:
+            return
+
+        failed = not ok or elapsed >= self.slow_seconds
+
+        with self.lock:
+            now = time.monotonic()
+
+            if probe:
+                self.probes_in_flight -= 1
+                if self.state != "half_open":
+                    return
+                if failed:
+                    self.open_for = min(self.open_for * 2, CIRCUIT_MAX_OPEN_SECONDS)
+                    self.trip(now)
+                    return
+                self.probe_successes += 1
+                if self.probe_successes >= self.probes:
+                    self.open_for = self.open_seconds
+                    self.transition("closed")
+                return
+
+            if self.state != "closed":
+                return
+
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= CIRCUIT_MIN_CALLS and sum(self.outcomes) >= self.failure_rate * len(self.outcomes):
+                self.trip(now)
+
+    def retry_in(self) -> float:
+        with self.lock:
+            if self.state == "open":
+                return max(0.0, self.opened_until - time.monotonic())
+            if self.state == "half_open" and self.probes_in_flight >= self.probes:
+                return CIRCUIT_PROBE_WAIT
+            return 0.0
+
+parcels_breaker = CircuitBreaker(
+    "parcels",
+    PARCELS_CIRCUIT_FAILURE_RATE,
+    PARCELS_CIRCUIT_WINDOW,
+    PARCELS_CIRCUIT_SLOW_SECONDS,
+    PARCELS_CIRCUIT_OPEN_SECONDS,
+)
+refresh_executor = ThreadPoolExecutor(
+    max_workers=max(1, REFRESH_CONCURRENCY),
+    thread_name_prefix="refresh",
+)
+
+refresh_stop = threading.Event()
+
+seen_updates = OrderedDict()
+seen_updates_lock = threading.Lock()
 
 def esc(value) -> str:
     return html.escape(str(value), quote=False)
@@ -46,6 +695,20 @@ def sanitize_tracking_number(raw: str) -> str:
         return ""
     return cleaned[:MAX_TRACK_NO_LENGTH]
 
+def parse_tracking_numbers(raw: str) -> list:
+    seen = set()
+    track_nos = []
+
+    for token in TRACK_NUMBER_SEPARATORS.split(raw or ""):
+        track_no = sanitize_tracking_number(token)
+        if not track_no or not any(ch.isdigit() for ch in track_no) or shipment_key(track_no) in seen:
+            continue
+        seen.add(shipment_key(track_no))
+        track_nos.append(track_no)
+
+    return track_nos
+
+@lru_cache(maxsize=512)
 def get_flag_emoji(code: str) -> str:
     if not code or len(code) != 2:
         return "🌍"
@@ -54,26 +717,378 @@ def get_flag_emoji(code: str) -> str:
     except Exception:
         return "🌍"
 
+class TelegramOutbox:
+    def __init__(self, chat_interval: float, store=None, lease_seconds: int = 120):
+        self.chat_interval = chat_interval
+        self.store = store
+        self.lease = timedelta(seconds=lease_seconds)
+        self.heap = []
+        self.chat_slots = {}
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.listeners = []
+
+    def put(self, chat_id: int, text: str, doc_id=None, attempts: int = 0):
+        if self.store is not None and doc_id is None:
+            try:
+                doc_id = self.store.insert_one(
+                    {
+                        "chat_id": chat_id,
+                        "text": text,
+                        "attempts": attempts,
+                        "created_at": datetime.utcnow(),
+                        "owner": INSTANCE_ID,
+                        "lease_until": datetime.utcnow() + self.lease,
+                    }
+                ).inserted_id
+            except Exception as e:
+                log.error("Telegram outbox store error: %s", e)
+
+        item = {"chat_id": chat_id, "text": text, "attempts": attempts, "doc_id": doc_id}
+
+        with self.cond:
+            now = time.monotonic()
+            slot = max(now, self.chat_slots.get(chat_id, 0))
+            self.chat_slots[chat_id] = slot + self.chat_interval
+            if len(self.chat_slots) > 10000:
+                self.chat_slots = {c: t for c, t in self.chat_slots.items() if t > now}
+            heapq.heappush(self.heap, (slot, next(self.seq), item))
+            self.cond.notify()
+
+        self.wake()
+
+    def retry(self, item: dict, delay: float):
+        with self.cond:
+            due = time.monotonic() + delay
+            chat_id = item["chat_id"]
+            self.chat_slots[chat_id] = max(self.chat_slots.get(chat_id, 0), due + self.chat_interval)
+            heapq.heappush(self.heap, (due, next(self.seq), item))
+            self.cond.notify()
+
+        self.wake()
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def wake(self):
+        for callback in self.listeners:
+            callback()
+
+    def get(self) -> dict:
+        with self.cond:
+            while True:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+
+                wait = self.heap[0][0] - time.monotonic()
+                if wait <= 0:
+                    return heapq.heappop(self.heap)[2]
+
+                self.cond.wait(wait)
+
+    def poll(self) -> tuple:
+        with self.cond:
+            if not self.heap:
+                return None, None
+
+            wait = self.heap[0][0] - time.monotonic()
+            if wait <= 0:
+                return heapq.heappop(self.heap)[2], 0.0
+
+            return None, wait
+
+    def done(self, item: dict):
+        if self.store is None or item.get("doc_id") is None:
+            return
+
+        try:
+            self.store.delete_one({"_id": item["doc_id"]})
+        except Exception as e:
+            log.error("Telegram outbox store error: %s", e)
+
+    def adopt(self, query: dict) -> int:
+        token = uuid.uuid4().hex
+        self.store.update_many(
+            query,
+            {
+                "$set": {
+                    "owner": INSTANCE_ID,
+                    "lease_until": datetime.utcnow() + self.lease,
+                    "adopt_token": token,
+                }
+            },
+        )
+
+        pending = list(self.store.find({"adopt_token": token}).sort("created_at", 1))
+        for doc in pending:
+            self.put(doc["chat_id"], doc["text"], doc_id=doc["_id"], attempts=doc.get("attempts", 0))
+        return len(pending)
+
+    def expired_query(self) -> dict:
+        return {
+            "owner": {"$ne": INSTANCE_ID},
+            "$or": [
+                {"lease_until": {"$lt": datetime.utcnow()}},
+                {"lease_until": {"$exists": False}},
+            ],
+        }
+
+    def restore(self):
+        if self.store is None:
+            return
+
+        try:
+            restored = self.adopt({"owner": INSTANCE_ID}) + self.adopt(self.expired_query())
+        except Exception as e:
+            log.error("Telegram outbox store error: %s", e)
+            return
+
+        if restored:
+            log.info("📨 Restored %d pending Telegram messages", restored)
+
+    def renew(self):
+        if self.store is None:
+            return
+
+        try:
+            self.store.update_many(
+                {"owner": INSTANCE_ID},
+                {"$set": {"lease_until": datetime.utcnow() + self.lease}},
+            )
+            adopted = self.adopt(self.expired_query())
+        except Exception as e:
+            log.error("Telegram outbox store error: %s", e)
+            return
+
+        if adopted:
+            log.info("📨 Took over %d Telegram messages from stopped instances", adopted)
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.heap)
+
+telegram_outbox = TelegramOutbox(
+    TELEGRAM_CHAT_INTERVAL,
+    store=telegram_outbox_store if TELEGRAM_OUTBOX_PERSIST else None,
+    lease_seconds=TELEGRAM_OUTBOX_LEASE_SECONDS,
+)
+telegram_senders_lock = threading.Lock()
+telegram_senders_started = False
+notifier_lock = threading.Lock()
+notifier_started = False
+notifier_streaming = threading.Event()
+
+def telegram_message_request(chat_id: int, message: str) -> tuple:
+    return (
+        f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/sendMessage",
+        {
+            "chat_id": chat_id,
+            "text": message,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True,
+        },
+    )
+
+def deliver_telegram(chat_id: int, message: str) -> tuple:
+    url, data = telegram_message_request(chat_id, message)
+    started = time.perf_counter()
+    try:
+        resp = transport.request("telegram", "POST", url, data=data)
+    except Exception as e:
+        metrics.inc("telegram_requests_total", outcome="exception")
+        log.warning("Telegram error: %s", e)
+        return False, None
+    finally:
+        metrics.observe("telegram_send_seconds", time.perf_counter() - started)
+
+    return telegram_delivery_result(chat_id, resp)
+
+async def deliver_telegram_async(chat_id: int, message: str) -> tuple:
+    url, data = telegram_message_request(chat_id, message)
+    started = time.perf_counter()
+    try:
+        if isinstance(transport, AsyncHttpTransport):
+            resp = await transport.arequest("telegram", "POST", url, data=data)
+        else:
+            resp = await asyncio.get_running_loop().run_in_executor(
+                None,
+                lambda: transport.request("telegram", "POST", url, data=data),
+            )
+    except Exception as e:
+        metrics.inc("telegram_requests_total", outcome="exception")
+        log.warning("Telegram error: %s", e)
+        return False, None
+    finally:
+        metrics.observe("telegram_send_seconds", time.perf_counter() - started)
+
+    return telegram_delivery_result(chat_id, resp)
+
+def telegram_delivery_result(chat_id: int, resp) -> tuple:
+    metrics.inc("telegram_requests_total", outcome=str(resp.status_code))
+
+    if resp.ok:
+        metrics.inc("notifications_sent_total")
+        return True, None
+
+    retry_after = None
+    try:
+        retry_after = (resp.json().get("parameters") or {}).get("retry_after")
+    except Exception:
+        pass
+
+    if resp.status_code == 429:
+        return False, float(retry_after or 1)
+
+    log.warning("Telegram error chat_id=%s status=%s body=%s", chat_id, resp.status_code, resp.text[:200])
+
+    if resp.status_code >= 500:
+        return False, None
+
+    return True, None
+
+def telegram_backoff(attempts: int) -> float:
+    return min(60, 2 ** attempts) + random.uniform(0, 1)
+
+def finish_telegram_item(item: dict, finished: bool, retry_after):
+    if finished:
+        telegram_outbox.done(item)
+        return
+
+    item["attempts"] += 1
+    if item["attempts"] >= TELEGRAM_MAX_ATTEMPTS:
+        metrics.inc("telegram_dropped_total")
+        log.warning("⚠️ Dropping Telegram message chat_id=%s attempts=%d", item["chat_id"], item["attempts"])
+        telegram_outbox.done(item)
+        return
+
+    telegram_outbox.retry(item, retry_after if retry_after is not None else telegram_backoff(item["attempts"]))
+
+def telegram_sender():
+    while True:
+        item = telegram_outbox.get()
+
+        try:
+            telegram_limiter.acquire()
+            finished, retry_after = deliver_telegram(item["chat_id"], item["text"])
+        except Exception as e:
+            log.exception("telegram_sender exception: %r", e)
+            finished, retry_after = False, None
+
+        finish_telegram_item(item, finished, retry_after)
+
+async def telegram_sender_async(wakeup: asyncio.Event):
+    loop = asyncio.get_running_loop()
+
+    while True:
+        wakeup.clear()
+        item, wait = telegram_outbox.poll()
+        if item is None:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        try:
+            await telegram_limiter.acquire_async()
+            finished, retry_after = await deliver_telegram_async(item["chat_id"], item["text"])
+        except asyncio.CancelledError:
+            telegram_outbox.retry(item, 0)
+            raise
+        except Exception as e:
+            log.exception("telegram_sender exception: %r", e)
+            finished, retry_after = False, None
+
+        if telegram_outbox.store is not None:
+            await loop.run_in_executor(None, finish_telegram_item, item, finished, retry_after)
+        else:
+            finish_telegram_item(item, finished, retry_after)
+
+def start_telegram_senders():
+    global telegram_senders_started
+
+    with telegram_senders_lock:
+        if telegram_senders_started:
+            return
+
+        telegram_senders_started = True
+        telegram_outbox.restore()
+        start_outbox_keeper()
+
+        for i in range(max(1, TELEGRAM_SENDERS)):
+            threading.Thread(
+                target=telegram_sender,
+                name=f"telegram-sender-{i}",
+                daemon=True,
+            ).start()
+
+def telegram_outbox_keeper():
+    while True:
+        time.sleep(max(1, TELEGRAM_OUTBOX_LEASE_SECONDS // 3))
+        telegram_outbox.renew()
+
+def start_outbox_keeper():
+    if telegram_outbox.store is not None:
+        threading.Thread(target=telegram_outbox_keeper, name="outbox-keeper", daemon=True).start()
+
 def send_telegram(chat_id: int, message: str):
     if not TELEGRAM_TOKEN:
-        print("⚠️ TELEGRAM_TOKEN is not set, cannot send message")
+        log.warning("⚠️ TELEGRAM_TOKEN is not set, cannot send message")
         return
 
-    url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+    if not telegram_senders_started:
+        start_telegram_senders()
+
+    telegram_outbox.put(chat_id, message)
+
+def telegram_call(method: str, data: dict, endpoint: str = "telegram"):
+    if not TELEGRAM_TOKEN:
+        log.warning("⚠️ TELEGRAM_TOKEN is not set, cannot call %s", method)
+        return None
+
+    telegram_limiter.acquire()
+    started = time.perf_counter()
     try:
-        session.post(
-            url,
-            data={
-                "chat_id": chat_id,
-                "text": message,
-                "parse_mode": "HTML",
-                "disable_web_page_preview": True,
-            },
-            timeout=10,
+        resp = transport.request(endpoint, "POST", f"{TELEGRAM_API_URL}/bot{TELEGRAM_TOKEN}/{method}", data=data)
+        body = resp.json()
+    except Exception as e:
+        metrics.inc("telegram_requests_total", outcome="exception")
+        log.warning("Telegram %s error: %s", method, e)
+        return None
+    finally:
+        metrics.observe("telegram_send_seconds", time.perf_counter() - started)
+
+    metrics.inc("telegram_requests_total", outcome=str(resp.status_code))
+
+    if not body.get("ok"):
+        log.warning("Telegram %s error status=%s body=%s", method, resp.status_code, resp.text[:200])
+        return None
+
+    return body.get("result")
+
+def download_telegram_document(document: dict):
+    file_info = telegram_call("getFile", {"file_id": document.get("file_id")})
+    if not file_info or not file_info.get("file_path"):
+        return None
+
+    try:
+        resp = transport.request(
+            "telegram_file",
+            "GET",
+            f"{TELEGRAM_API_URL}/file/bot{TELEGRAM_TOKEN}/{file_info['file_path']}",
         )
     except Exception as e:
-        print("Telegram error:", e)
+        log.warning("Telegram file download error: %s", e)
+        return None
+
+    if not resp.ok:
+        log.warning("Telegram file download error status=%s", resp.status_code)
+        return None
+
+    return resp.content[:TRACK_DOCUMENT_MAX_BYTES].decode("utf-8-sig", errors="replace")
 
+@lru_cache(maxsize=20000)
 def parse_iso_to_kyiv(dt_str: str) -> str:
     if not dt_str:
         return "невідомо"
@@ -89,77 +1104,1006 @@ def parse_iso_to_kyiv(dt_str: str) -> str:
     except Exception:
         return dt_str
 
-def query_parcels_track(track_no: str):
+def parcels_request(method: str, **kwargs):
+    probe = parcels_breaker.before_call()
+    parcels_limiter.acquire()
+    started = time.perf_counter()
+
+    try:
+        resp = transport.request("parcels", method, PARCELS_TRACKING_URL, **kwargs)
+    except Exception:
+        metrics.inc("parcels_requests_total", method=method, outcome="exception")
+        parcels_breaker.record(probe, False, time.perf_counter() - started)
+        raise
+    finally:
+        metrics.observe("parcels_request_seconds", time.perf_counter() - started, method=method)
+
+    parcels_breaker.record(
+        probe,
+        resp.status_code < 500 and resp.status_code != 429,
+        time.perf_counter() - started,
+    )
+    metrics.inc("parcels_requests_total", method=method, outcome=str(resp.status_code))
+    log.debug("Parcels %s status=%s", method, resp.status_code, extra=SAMPLED)
+    return resp
+
+def shipment_key(tracking_id) -> str:
+    return str(tracking_id or "").strip().upper()
+
+def collect_shipments(wanted: dict, results: dict, shipments: list):
+    for shipment in shipments or []:
+        tn = wanted.get(shipment_key(shipment.get("trackingId") or shipment.get("tracking_id")))
+        if not tn:
+            continue
+
+        if shipment.get("error"):
+            log.info("Parcels shipment error track_no=%s error=%s", tn, shipment["error"])
+            results.pop(tn, None)
+            continue
+
+        results[tn] = shipment
+
+class ParcelsPoller:
+    def __init__(self, base_delay: float, max_delay: float, deadline: float, workers: int):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.heap = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="parcels-poll")
+        self.started = False
+
+    def register(self, uuid_: str, wanted: dict, results: dict, future: Future):
+        entry = {
+            "uuid": uuid_,
+            "wanted": wanted,
+            "results": results,
+            "future": future,
+            "attempt": 0,
+            "deadline": time.monotonic() + self.deadline,
+        }
+
+        with self.cond:
+            if not self.started:
+                threading.Thread(target=self.run, name="parcels-poller", daemon=True).start()
+                self.started = True
+
+            self.schedule(entry, self.base_delay)
+
+    def schedule(self, entry: dict, delay: float):
+        with self.cond:
+            heapq.heappush(self.heap, (time.monotonic() + delay, next(self.seq), entry))
+            self.cond.notify()
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.heap)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap or self.heap[0][0] > time.monotonic():
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                entry = heapq.heappop(self.heap)[2]
+
+            self.executor.submit(self.poll, entry)
+
+    def poll(self, entry: dict):
+        future = entry["future"]
+        uuid_ = entry["uuid"]
+
+        try:
+            resp = parcels_request(
+                "GET",
+                params={"uuid": uuid_, "apiKey": PARCELS_API_KEY},
+                headers={"Accept": "application/json"},
+            )
+
+            if resp.ok:
+                data = resp.json()
+
+                if data.get("error"):
+                    metrics.inc("parcels_errors_total", kind="api")
+                    log.warning("Parcels error: %s", data["error"])
+                    future.set_result({})
+                    return
+
+                collect_shipments(entry["wanted"], entry["results"], data.get("shipments"))
+
+                if data.get("done", False):
+                    future.set_result(entry["results"])
+                    return
+
+        except CircuitOpenError as e:
+            future.set_exception(e)
+            return
+        except Exception as e:
+            log.warning("Parcels poll exception uuid=%s: %s", uuid_, e)
+
+        entry["attempt"] += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** entry["attempt"])
+
+        if time.monotonic() + delay > entry["deadline"]:
+            metrics.inc("parcels_errors_total", kind="deadline")
+            log.warning("⚠️ Parcels lookup not done before deadline uuid=%s pending=%d", uuid_, len(entry["wanted"]))
+            future.set_result({})
+            return
+
+        self.schedule(entry, delay)
+
+parcels_poller = ParcelsPoller(
+    PARCELS_POLL_BASE_DELAY,
+    PARCELS_POLL_MAX_DELAY,
+    PARCELS_POLL_DEADLINE,
+    PARCELS_POLL_WORKERS,
+)
+
+def submit_parcels_batch(track_nos: list) -> Future:
+    future = Future()
+
     if not PARCELS_API_KEY:
-        print("❌ No PARCELS_API_KEY set")
-        return None
+        log.error("❌ No PARCELS_API_KEY set")
+        future.set_result({})
+        return future
+
+    if not track_nos:
+        future.set_result({})
+        return future
 
     payload = {
         "shipments": [
             {
-                "trackingId": str(track_no),
+                "trackingId": str(tn),
                 "destinationCountry": PARCELS_DESTINATION_COUNTRY,
             }
+            for tn in track_nos
         ],
         "language": PARCELS_LANGUAGE,
         "apiKey": PARCELS_API_KEY,
     }
 
+    wanted = {shipment_key(tn): tn for tn in track_nos}
+    results = {}
+
     try:
-        resp = session.post(
-            PARCELS_TRACKING_URL,
+        resp = parcels_request(
+            "POST",
             json=payload,
             headers={"Content-Type": "application/json"},
-            timeout=25,
         )
 
-        print("Parcels POST:", track_no, resp.status_code, resp.text[:300])
-
         if not resp.ok:
-            return None
+            future.set_result({})
+            return future
 
         data = resp.json()
 
         if data.get("error"):
-            print("Parcels error:", data["error"])
+            metrics.inc("parcels_errors_total", kind="api")
+            log.warning("Parcels error: %s", data["error"])
+            future.set_result({})
+            return future
+
+        collect_shipments(wanted, results, data.get("shipments"))
+
+        uuid_ = data.get("uuid")
+        if uuid_ and not data.get("done", False):
+            parcels_poller.register(uuid_, wanted, results, future)
+            return future
+
+    except CircuitOpenError as e:
+        future.set_exception(e)
+        return future
+    except Exception as e:
+        log.warning("Parcels exception: %s", e)
+        future.set_result({})
+        return future
+
+    future.set_result(results)
+    return future
+
+def query_parcels_batch(track_nos: list) -> dict:
+    results = submit_parcels_batch(track_nos).result(timeout=PARCELS_POLL_DEADLINE + 60)
+
+    missing = len(track_nos) - len(results)
+    if missing:
+        log.info("⚠️ Parcels batch: %d of %d shipments without data", missing, len(track_nos))
+
+    return results
+
+def query_parcels_track(track_no: str):
+    shipment = query_parcels_batch([track_no]).get(track_no)
+    if not shipment:
+        return None
+
+    return {"shipments": [shipment]}
+
+def chunked(items: list, size: int):
+    size = max(1, size)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class CacheFlight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class ParcelsCache:
+    def __init__(self, ttl: int, max_entries: int, store=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.shared = 0
+        self.misses = 0
+
+    def get(self, track_no: str, loader):
+        if self.ttl <= 0:
+            return loader(track_no)
+
+        now = time.monotonic()
+        leader = False
+
+        with self.lock:
+            entry = self.entries.get(track_no)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(track_no)
+                self.hits += 1
+                return entry[1]
+
+            if entry:
+                del self.entries[track_no]
+
+            flight = self.inflight.get(track_no)
+            if flight:
+                self.shared += 1
+            else:
+                flight = CacheFlight()
+                self.inflight[track_no] = flight
+                leader = True
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            data = self.load_persisted(track_no)
+            if data is not None:
+                with self.lock:
+                    self.store_hits += 1
+                self.put(track_no, data, persist=False)
+            else:
+                with self.lock:
+                    self.misses += 1
+                data = loader(track_no)
+                if data is not None:
+                    self.put(track_no, data)
+
+            flight.result = data
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(track_no, None)
+            flight.event.set()
+
+        return data
+
+    def put(self, track_no: str, data: dict, persist: bool = True):
+        self.put_many({track_no: data}, persist=persist)
+
+    def put_many(self, items: dict, persist: bool = True):
+        items = {track_no: data for track_no, data in items.items() if data is not None}
+        if self.ttl <= 0 or not items:
+            return
+
+        with self.lock:
+            expires = time.monotonic() + self.ttl
+            for track_no, data in items.items():
+                self.entries[track_no] = (expires, data)
+                self.entries.move_to_end(track_no)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        if persist and self.store is not None:
+            expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+            try:
+                self.store.bulk_write(
+                    [
+                        ReplaceOne(
+                            {"_id": track_no},
+                            {"_id": track_no, "data": data, "expires_at": expires_at},
+                            upsert=True,
+                        )
+                        for track_no, data in items.items()
+                    ],
+                    ordered=False,
+                )
+            except Exception as e:
+                log.error("Parcels cache store error: %s", e)
+
+    def peek(self, track_no: str):
+        if self.ttl <= 0:
             return None
 
-        uuid = data.get("uuid")
-        shipments = data.get("shipments") or []
-        done = data.get("done", False)
+        with self.lock:
+            entry = self.entries.get(track_no)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(track_no)
+                self.hits += 1
+                return entry[1]
 
-        final_shipments = shipments
+        return None
 
-        if uuid and not done:
-            for _ in range(3):
-                time.sleep(2)
+    def invalidate(self, track_no: str):
+        with self.lock:
+            self.entries.pop(track_no, None)
 
-                status_resp = session.get(
-                    PARCELS_TRACKING_URL,
-                    params={"uuid": uuid, "apiKey": PARCELS_API_KEY},
-                    headers={"Accept": "application/json"},
-                    timeout=25,
+        if self.store is not None:
+            try:
+                self.store.delete_one({"_id": track_no})
+            except Exception as e:
+                log.error("Parcels cache store error: %s", e)
+
+    def load_persisted(self, track_no: str):
+        if self.store is None:
+            return None
+
+        try:
+            doc = self.store.find_one(
+                {"_id": track_no, "expires_at": {"$gt": datetime.utcnow()}}
+            )
+        except Exception as e:
+            log.error("Parcels cache store error: %s", e)
+            return None
+
+        return doc.get("data") if doc else None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "shared": self.shared,
+                "misses": self.misses,
+            }
+
+parcels_cache = ParcelsCache(
+    PARCELS_CACHE_TTL,
+    PARCELS_CACHE_MAX_ENTRIES,
+    store=parcels_cache_store if PARCELS_CACHE_PERSIST else None,
+)
+
+def cached_query_parcels_track(track_no: str):
+    return parcels_cache.get(track_no, query_parcels_track)
+
+class ListViewCache:
+    def __init__(self, ttl: int, max_chats: int, store=None, store_ttl: int = 0):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.store = store
+        self.store_ttl = store_ttl
+        self.views = OrderedDict()
+        self.chats_by_track = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def page(self, chat_id: int, page: int, page_size: int, loader) -> tuple:
+        page_size = max(1, page_size)
+
+        with self.lock:
+            view = self.fresh_view(chat_id)
+            if view:
+                self.hits += 1
+                return self.slice(view, page, page_size)
+
+        entries = self.load_persisted(chat_id)
+        if entries is not None:
+            with self.lock:
+                self.store_hits += 1
+        else:
+            with self.lock:
+                self.misses += 1
+            entries = loader(chat_id)
+            self.persist(chat_id, entries)
+
+        with self.lock:
+            view = self.install(chat_id, entries)
+            return self.slice(view, page, page_size)
+
+    def fresh_view(self, chat_id: int):
+        view = self.views.get(chat_id)
+        if not view:
+            return None
+
+        if view["expires"] <= time.monotonic():
+            self.evict(chat_id)
+            return None
+
+        self.views.move_to_end(chat_id)
+        return view
+
+    def slice(self, view: dict, page: int, page_size: int) -> tuple:
+        total = len(view["track_nos"])
+        pages = max(1, -(-total // page_size))
+        page = min(max(1, page), pages)
+        start = (page - 1) * page_size
+        items = [view["entries"][tn] for tn in view["track_nos"][start:start + page_size]]
+        return items, page, pages
+
+    def install(self, chat_id: int, entries: dict) -> dict:
+        self.evict(chat_id)
+
+        view = {
+            "expires": time.monotonic() + self.ttl,
+            "track_nos": sorted(entries),
+            "entries": dict(entries),
+        }
+        self.views[chat_id] = view
+        for track_no in entries:
+            self.chats_by_track.setdefault(track_no, set()).add(chat_id)
+
+        while len(self.views) > self.max_chats:
+            self.evict(next(iter(self.views)))
+
+        return view
+
+    def evict(self, chat_id: int):
+        view = self.views.pop(chat_id, None)
+        if not view:
+            return
+
+        for track_no in view["track_nos"]:
+            chats = self.chats_by_track.get(track_no)
+            if chats:
+                chats.discard(chat_id)
+                if not chats:
+                    del self.chats_by_track[track_no]
+
+    def set_entries(self, chat_id: int, entries: dict):
+        if not entries:
+            return
+
+        with self.lock:
+            view = self.fresh_view(chat_id)
+            if view:
+                for track_no, text in entries.items():
+                    if track_no not in view["entries"]:
+                        bisect.insort(view["track_nos"], track_no)
+                        self.chats_by_track.setdefault(track_no, set()).add(chat_id)
+                    view["entries"][track_no] = text
+
+        if self.store is None:
+            return
+
+        try:
+            for track_no, text in entries.items():
+                result = self.store.update_one(
+                    {"_id": chat_id, "entries.track_no": track_no},
+                    {"$set": {"entries.$.text": text}},
+                )
+                if result.matched_count == 0:
+                    self.store.update_one(
+                        {"_id": chat_id, "entries.track_no": {"$ne": track_no}},
+                        {"$push": {"entries": {"track_no": track_no, "text": text}}},
+                    )
+        except Exception as e:
+            log.error("List view store error: %s", e)
+
+    def remove_entry(self, chat_id: int, track_no: str):
+        with self.lock:
+            view = self.views.get(chat_id)
+            if view and view["entries"].pop(track_no, None) is not None:
+                view["track_nos"].remove(track_no)
+                chats = self.chats_by_track.get(track_no)
+                if chats:
+                    chats.discard(chat_id)
+                    if not chats:
+                        del self.chats_by_track[track_no]
+
+        if self.store is not None:
+            try:
+                self.store.update_one(
+                    {"_id": chat_id},
+                    {"$pull": {"entries": {"track_no": track_no}}},
+                )
+            except Exception as e:
+                log.error("List view store error: %s", e)
+
+    def update_tracks(self, entries: dict):
+        if not entries:
+            return
+
+        with self.lock:
+            for track_no, text in entries.items():
+                for chat_id in self.chats_by_track.get(track_no, ()):
+                    self.views[chat_id]["entries"][track_no] = text
+
+        if self.store is not None:
+            try:
+                self.store.bulk_write(
+                    [
+                        UpdateMany(
+                            {"entries.track_no": track_no},
+                            {"$set": {"entries.$.text": text}},
+                        )
+                        for track_no, text in entries.items()
+                    ],
+                    ordered=False,
                 )
+            except Exception as e:
+                log.error("List view store error: %s", e)
+
+    def persist(self, chat_id: int, entries: dict):
+        if self.store is None:
+            return
+
+        try:
+            self.store.replace_one(
+                {"_id": chat_id},
+                {
+                    "_id": chat_id,
+                    "entries": [{"track_no": tn, "text": text} for tn, text in entries.items()],
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.store_ttl),
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            log.error("List view store error: %s", e)
 
-                print("Parcels GET:", track_no, status_resp.status_code, status_resp.text[:300])
+    def load_persisted(self, chat_id: int):
+        if self.store is None:
+            return None
 
-                if not status_resp.ok:
-                    break
+        try:
+            doc = self.store.find_one(
+                {"_id": chat_id, "expires_at": {"$gt": datetime.utcnow()}}
+            )
+        except Exception as e:
+            log.error("List view store error: %s", e)
+            return None
+
+        if not doc:
+            return None
+
+        return {e["track_no"]: e["text"] for e in doc.get("entries") or []}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "chats": len(self.views),
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+            }
+
+list_views = ListViewCache(
+    LIST_VIEW_TTL,
+    LIST_VIEW_MAX_CHATS,
+    store=list_views_store if LIST_VIEW_PERSIST else None,
+    store_ttl=LIST_VIEW_STORE_TTL,
+)
+
+def list_entry_for(track_no: str, tr: dict) -> str:
+    return render_list_entry(
+        track_no,
+        tr.get("last_status", "статус ще невідомий"),
+        tr.get("time_str") or "час невідомий",
+        tr.get("origin", "Unknown"),
+        tr.get("origin_code") or "",
+        tr.get("destination", "Unknown"),
+        tr.get("destination_code") or "",
+    )
+
+def load_list_entries(chat_id: int) -> dict:
+    track_nos = sorted({
+        s["track_no"]
+        for s in subscriptions.find({"chat_id": chat_id}, {"track_no": 1})
+        if s.get("track_no")
+    })
+    if not track_nos:
+        return {}
+
+    tracks_map = {
+        t["track_no"]: t
+        for t in trackings.find({"track_no": {"$in": track_nos}}, LIST_ENTRY_FIELDS)
+    }
+    return {tn: list_entry_for(tn, tracks_map.get(tn, {})) for tn in track_nos}
+
+def index_time(value) -> float:
+    if value is None:
+        return math.inf
+    return (value - UNIX_EPOCH).total_seconds()
+
+class TrackingRecord:
+    __slots__ = ("status", "next_check", "subscribers")
+
+    def __init__(self, status=None, next_check: float = math.inf):
+        self.status = status
+        self.next_check = next_check
+        self.subscribers = array("q")
+
+class TrackingIndex:
+    def __init__(self, enabled: bool, snapshot_path: str = ""):
+        self.enabled = enabled
+        self.snapshot_path = snapshot_path
+        self.records = {}
+        self.due_heap = []
+        self.deferred = []
+        self.subscription_count = 0
+        self.synced_at = None
+        self.ready = False
+        self.lock = threading.RLock()
+        self.full_loads = 0
+        self.delta_loads = 0
+        self.snapshot_loads = 0
+
+    def record(self, track_no: str) -> TrackingRecord:
+        record = self.records.get(track_no)
+        if record is None:
+            record = self.records[sys.intern(track_no)] = TrackingRecord()
+        return record
+
+    def schedule(self, track_no: str, record: TrackingRecord, next_check: float):
+        if record.next_check == next_check:
+            return
+        record.next_check = next_check
+        if next_check != math.inf:
+            heapq.heappush(self.due_heap, (next_check, track_no))
+
+    def apply_fields(self, track_no: str, fields: dict):
+        record = self.record(track_no)
+        if "last_status" in fields:
+            record.status = sys.intern(fields["last_status"]) if fields["last_status"] else None
+        if "next_check_at" in fields:
+            self.schedule(track_no, record, index_time(fields["next_check_at"]))
+
+    def apply_doc(self, tr: dict):
+        track_no = tr.get("track_no")
+        if not track_no:
+            return
+        self.apply_fields(track_no, {"next_check_at": UNIX_EPOCH, **tr})
+
+    def add_subscriber(self, chat_id: int, track_no: str):
+        record = self.record(track_no)
+        if chat_id not in record.subscribers:
+            record.subscribers.append(chat_id)
+            self.subscription_count += 1
+
+    def install(self, records: dict, subscription_count: int, synced_at: datetime):
+        heap = [(r.next_check, tn) for tn, r in records.items() if r.next_check != math.inf]
+        heapq.heapify(heap)
+
+        with self.lock:
+            self.records = records
+            self.due_heap = heap
+            self.deferred = []
+            self.subscription_count = subscription_count
+            self.synced_at = synced_at
+            self.ready = True
+
+    def load_all(self):
+        started = datetime.utcnow()
+        loader = TrackingIndex(True)
+
+        for tr in trackings.find({}, TRACKING_INDEX_FIELDS):
+            loader.apply_doc(tr)
+        for sub in subscriptions.find({}, {"_id": 0, "chat_id": 1, "track_no": 1}):
+            if sub.get("track_no") and sub.get("chat_id") is not None:
+                loader.add_subscriber(sub["chat_id"], sub["track_no"])
+
+        self.install(loader.records, loader.subscription_count, started)
+        self.full_loads += 1
+        log.info(
+            "🗂 Tracking index loaded from MongoDB: %d parcels, %d subscriptions, %.1fs",
+            len(loader.records),
+            loader.subscription_count,
+            (datetime.utcnow() - started).total_seconds(),
+        )
+
+    def catch_up(self) -> bool:
+        started = datetime.utcnow()
+        since = self.synced_at - TRACKING_INDEX_OVERLAP
+
+        if started - since >= TRACKING_INDEX_TOMBSTONE_TTL:
+            log.info("🗂 Tracking index is older than the removal log, reloading")
+            return False
+
+        changed = list(trackings.find({"updated_at": {"$gte": since}}, TRACKING_INDEX_FIELDS))
+        subscribed = list(
+            subscriptions.find({"created_at": {"$gte": since}}, {"_id": 0, "chat_id": 1, "track_no": 1, "created_at": 1})
+        )
+        removed = list(tracking_removals.find({"removed_at": {"$gte": since}}, {"_id": 0}))
+
+        events = sorted(
+            [(rm["removed_at"], 0, rm) for rm in removed]
+            + [(tr.get("updated_at") or since, 1, tr) for tr in changed]
+            + [(sub.get("created_at") or since, 2, sub) for sub in subscribed],
+            key=lambda event: (event[0], event[1]),
+        )
+
+        with self.lock:
+            for _, kind, doc in events:
+                if not doc.get("track_no"):
+                    continue
+                if kind == 0:
+                    self.drop(doc.get("chat_id"), doc["track_no"], doc.get("tracking_removed"))
+                elif kind == 1:
+                    self.apply_doc(doc)
+                elif doc.get("chat_id") is not None:
+                    self.add_subscriber(doc["chat_id"], doc["track_no"])
+            self.synced_at = started
+
+        self.delta_loads += 1
+        log.info(
+            "🗂 Tracking index caught up: %d changed parcels, %d new subscriptions, %d removals",
+            len(changed),
+            len(subscribed),
+            len(removed),
+        )
+        return True
+
+    def sync(self):
+        if not self.enabled:
+            return
+
+        try:
+            if not self.ready and not self.load_snapshot():
+                self.load_all()
+            elif not self.catch_up():
+                self.load_all()
+        except Exception as e:
+            log.exception("Tracking index sync error: %r", e)
+
+    def load_snapshot(self) -> bool:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return False
+
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("version") != TRACKING_INDEX_SNAPSHOT_VERSION:
+                    return False
+
+                count = header["count"]
+                status_ids = array("I")
+                next_checks = array("d")
+                counts = array("I")
+                subscribers = array("q")
+                status_ids.fromfile(f, count)
+                next_checks.fromfile(f, count)
+                counts.fromfile(f, count)
+                subscribers.fromfile(f, header["subscribers"])
+        except Exception as e:
+            log.warning("⚠️ Could not read tracking index snapshot %s: %s", self.snapshot_path, e)
+            return False
+
+        if header["byteorder"] != sys.byteorder:
+            for values in (status_ids, next_checks, counts, subscribers):
+                values.byteswap()
+
+        statuses = [sys.intern(status) if status else None for status in header["statuses"]]
+        records = {}
+        offset = 0
+        for track_no, status_id, next_check, n in zip(header["track_nos"], status_ids, next_checks, counts):
+            record = records[sys.intern(track_no)] = TrackingRecord(statuses[status_id], next_check)
+            record.subscribers = subscribers[offset:offset + n]
+            offset += n
+
+        self.install(records, len(subscribers), datetime.fromisoformat(header["synced_at"]))
+        self.snapshot_loads += 1
+        log.info("🗂 Tracking index loaded from %s: %d parcels", self.snapshot_path, len(records))
+        return True
+
+    def save_snapshot(self):
+        if not self.snapshot_path or not self.ready:
+            return
+
+        status_table = {}
+        with self.lock:
+            records = list(self.records.items())
+            synced_at = self.synced_at
+            status_ids = array("I", (status_table.setdefault(r.status, len(status_table)) for _, r in records))
+            next_checks = array("d", (r.next_check for _, r in records))
+            counts = array("I", (len(r.subscribers) for _, r in records))
+            subscribers = array("q")
+            for _, record in records:
+                subscribers.extend(record.subscribers)
+
+        header = {
+            "version": TRACKING_INDEX_SNAPSHOT_VERSION,
+            "byteorder": sys.byteorder,
+            "synced_at": synced_at.isoformat(),
+            "count": len(records),
+            "subscribers": len(subscribers),
+            "statuses": list(status_table),
+            "track_nos": [tn for tn, _ in records],
+        }
+
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+                for values in (status_ids, next_checks, counts, subscribers):
+                    values.tofile(f)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            log.error("Tracking index snapshot error: %s", e)
+
+    def update(self, changes: dict):
+        if not self.ready:
+            return
+
+        with self.lock:
+            for track_no, fields in changes.items():
+                self.apply_fields(track_no, fields)
+
+    def subscribe(self, chat_id: int, track_nos: list):
+        if not self.ready:
+            return
+
+        with self.lock:
+            for track_no in track_nos:
+                self.add_subscriber(chat_id, track_no)
+
+    def drop(self, chat_id, track_no: str, tracking_removed: bool):
+        if tracking_removed:
+            record = self.records.pop(track_no, None)
+            if record is not None:
+                self.subscription_count -= len(record.subscribers)
+            return
+
+        record = self.records.get(track_no)
+        if record is not None and chat_id in record.subscribers:
+            record.subscribers.remove(chat_id)
+            self.subscription_count -= 1
+
+    def forget(self, chat_id: int, track_no: str, tracking_removed: bool):
+        if not self.enabled:
+            return
+
+        tracking_removals.insert_one(
+            {
+                "chat_id": chat_id,
+                "track_no": track_no,
+                "tracking_removed": tracking_removed,
+                "removed_at": datetime.utcnow(),
+            }
+        )
+
+        if self.ready:
+            with self.lock:
+                self.drop(chat_id, track_no, tracking_removed)
+
+    def subscribed_among(self, chat_id: int, track_nos: list):
+        if not self.ready:
+            return None
 
-                status_data = status_resp.json()
+        with self.lock:
+            return {
+                tn for tn in track_nos
+                if tn in self.records and chat_id in self.records[tn].subscribers
+            }
+
+    def is_subscribed(self, chat_id: int, track_no: str):
+        known = self.subscribed_among(chat_id, [track_no])
+        return None if known is None else bool(known)
+
+    def due(self, before: datetime, limit: int):
+        if not self.ready:
+            return None
 
-                if status_data.get("shipments"):
-                    final_shipments = status_data["shipments"]
+        cutoff = index_time(before)
+        picked = {}
 
-                if status_data.get("done", False):
+        with self.lock:
+            while self.due_heap and len(picked) < limit:
+                next_check, track_no = self.due_heap[0]
+                if next_check > cutoff:
                     break
 
-        data["shipments"] = final_shipments
-        return data
+                heapq.heappop(self.due_heap)
+                record = self.records.get(track_no)
+                if record is not None and record.next_check == next_check:
+                    picked[track_no] = None
 
-    except Exception as e:
-        print("Parcels exception:", e)
-        return None
+        return list(picked)
+
+    def due_count(self, before: datetime):
+        if not self.ready:
+            return None
+
+        cutoff = index_time(before)
+        with self.lock:
+            return sum(1 for record in self.records.values() if record.next_check <= cutoff)
+
+    def defer(self, track_nos: list):
+        if not self.ready:
+            return
+
+        with self.lock:
+            self.deferred.extend(track_nos)
+
+    def requeue(self):
+        if not self.ready:
+            return
+
+        with self.lock:
+            for track_no in self.deferred:
+                record = self.records.get(track_no)
+                if record is not None and record.next_check != math.inf:
+                    heapq.heappush(self.due_heap, (record.next_check, track_no))
+            self.deferred = []
+
+            if len(self.due_heap) > 2 * len(self.records) + 1024:
+                self.due_heap = [
+                    (r.next_check, tn) for tn, r in self.records.items() if r.next_check != math.inf
+                ]
+                heapq.heapify(self.due_heap)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "parcels": len(self.records),
+                "subscriptions": self.subscription_count,
+                "queued": len(self.due_heap),
+                "full_loads": self.full_loads,
+                "delta_loads": self.delta_loads,
+                "snapshot_loads": self.snapshot_loads,
+            }
+
+tracking_index = TrackingIndex(TRACKING_INDEX, TRACKING_INDEX_SNAPSHOT)
+
+def ensure_indexes():
+    index_specs = [
+        (trackings, [("track_no", 1)], {"unique": True}),
+        (trackings, [("next_check_at", 1)], {}),
+        (trackings, [("lease_token", 1)], {"sparse": True}),
+        (trackings, [("notice_at", 1)], {"sparse": True}),
+        (trackings, [("notice_claim", 1)], {"sparse": True}),
+        (trackings, [("notice_claim_at", 1)], {"sparse": True}),
+        (subscriptions, [("chat_id", 1), ("track_no", 1)], {"unique": True}),
+        (subscriptions, [("track_no", 1)], {}),
+        (users, [("chat_id", 1)], {}),
+        (digests, [("due_at", 1)], {}),
+    ]
+
+    for collection, keys, options in index_specs:
+        try:
+            collection.create_index(keys, **options)
+        except Exception as e:
+            log.error("⚠️ Could not create index %s on %s: %s", keys, collection.name, e)
+
+    if PARCELS_CACHE_PERSIST:
+        parcels_cache_store.create_index("expires_at", expireAfterSeconds=0)
+
+    if TELEGRAM_OUTBOX_PERSIST:
+        telegram_outbox_store.create_index([("owner", 1), ("lease_until", 1)])
+        telegram_outbox_store.create_index("adopt_token", sparse=True)
+
+    if LIST_VIEW_PERSIST:
+        list_views_store.create_index("expires_at", expireAfterSeconds=0)
+        list_views_store.create_index("entries.track_no")
+
+    if TRACKING_INDEX:
+        trackings.create_index("updated_at")
+        subscriptions.create_index("created_at")
+        tracking_removals.create_index(
+            "removed_at",
+            expireAfterSeconds=int(TRACKING_INDEX_TOMBSTONE_TTL.total_seconds()),
+        )
 
 def extract_main_fields(api_response: dict) -> dict:
     root = api_response.get("data", api_response)
@@ -196,6 +2140,7 @@ def extract_main_fields(api_response: dict) -> dict:
     tracking_number = shipment.get("trackingId") or shipment.get("tracking_id")
 
     result = {
+        "shipment_status": str(shipment.get("status") or ""),
         "status_text": str(status_text),
         "time_str": parse_iso_to_kyiv(time_raw) if time_raw else "невідомо",
         "origin": origin,
@@ -209,53 +2154,376 @@ def extract_main_fields(api_response: dict) -> dict:
 
     return result
 
-def fetch_initial_status(track_no: str, chat_id: int) -> bool:
-    data = query_parcels_track(track_no)
+def normalize_state(ev: dict) -> dict:
+    return {
+        "date": str(ev.get("date") or ev.get("time") or ""),
+        "status": str(ev.get("status") or ev.get("description") or ev.get("message") or ""),
+        "location": str(ev.get("location") or ""),
+    }
 
-    if not data:
-        return False
+def normalize_event_text(text: str) -> str:
+    return " ".join(re.sub(r"[^\w]+", " ", (text or "").lower()).split())
+
+def event_identity(ev: dict) -> tuple:
+    date = (ev.get("date") or "").strip()
+    location = normalize_event_text(ev.get("location"))
+    status = "" if date else normalize_event_text(ev.get("status"))
+    return date, location, status
+
+def event_fingerprint(ev: dict, occurrence: int = 0) -> str:
+    raw = "|".join(event_identity(ev)) + f"|{occurrence}"
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+def event_fingerprints(states: list) -> list:
+    occurrences = Counter()
+    fps = []
+    for ev in states or []:
+        identity = event_identity(ev)
+        fps.append(event_fingerprint(ev, occurrences[identity]))
+        occurrences[identity] += 1
+    return fps
+
+def merge_states(stored: list, fresh: list) -> list:
+    fresh = [normalize_state(ev) for ev in fresh or []]
+    stored = list(stored or [])
+    merged = []
+    seen = set()
+
+    for ev, key in zip(fresh + stored, event_fingerprints(fresh) + event_fingerprints(stored)):
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(ev)
+
+    if fresh and len(merged) > len(fresh):
+        newest_first = fresh[0]["date"] > fresh[-1]["date"]
+        merged.sort(key=lambda ev: ev.get("date") or "", reverse=newest_first)
+
+    return merged
+
+def stored_fingerprints(tr: dict) -> set:
+    fps = tr.get("event_fps")
+    if fps is None or tr.get("event_fps_version") != EVENT_FINGERPRINT_VERSION:
+        fps = event_fingerprints(tr.get("states"))
+    return set(fps)
+
+def tracking_meta(tr: dict) -> dict:
+    states = tr.get("states") or []
+    return {
+        "status_text": tr.get("last_status", "UNKNOWN"),
+        "time_str": tr.get("time_str") or "невідомо",
+        "origin": tr.get("origin", "Unknown"),
+        "destination": tr.get("destination", "Unknown"),
+        "origin_code": tr.get("origin_code") or "",
+        "destination_code": tr.get("destination_code") or "",
+        "tracking_number": tr.get("track_no"),
+        "raw_last_event": max(states, key=lambda ev: ev.get("date") or "") if states else None,
+        "states": states,
+    }
+
+def classify_stage(meta: dict) -> str:
+    code = (meta.get("shipment_status") or "").lower()
+    if code in STAGE_STATUS_CODES:
+        return STAGE_STATUS_CODES[code]
+
+    text = (meta.get("status_text") or "").lower()
+    for stage, keywords in STAGE_KEYWORDS:
+        if any(k in text for k in keywords):
+            return stage
+
+    return "in_transit"
+
+def compute_schedule(stage: str, last_change_at: datetime, now: datetime):
+    if stage in FINAL_STAGES:
+        return stage, None
+
+    if stage == "out_for_delivery":
+        return stage, now + timedelta(seconds=REFRESH_INTERVAL)
+
+    idle = now - (last_change_at or now)
 
+    if idle >= SCHEDULE_EXPIRE_AFTER:
+        return "expired", None
+    if idle >= SCHEDULE_STALE_AFTER:
+        return stage, now + SCHEDULE_STALE_INTERVAL
+    if idle >= SCHEDULE_IDLE_AFTER:
+        return stage, now + SCHEDULE_IDLE_INTERVAL
+
+    return stage, now + SCHEDULE_ACTIVE_INTERVAL
+
+def due_trackings_query(now: datetime) -> dict:
+    return {
+        "$or": [
+            {"next_check_at": {"$lte": now}},
+            {"next_check_at": {"$exists": False}},
+        ]
+    }
+
+def claimable_trackings_query(due_before: datetime, now: datetime = None) -> dict:
+    now = now or due_before
+    return {
+        "$and": [
+            due_trackings_query(due_before),
+            {"$or": [{"lease_until": None}, {"lease_until": {"$lte": now}}]},
+        ]
+    }
+
+def claim_due_batch(limit: int, due_before: datetime):
+    now = datetime.utcnow()
+    query = claimable_trackings_query(due_before, now)
+
+    candidates = tracking_index.due(due_before, limit)
+    if candidates is None:
+        ids = [
+            t["_id"]
+            for t in trackings.find(query, {"_id": 1}).sort("next_check_at", 1).limit(limit)
+        ]
+        selector = {"_id": {"$in": ids}}
+    else:
+        ids = candidates
+        selector = {"track_no": {"$in": candidates}}
+
+    if not ids:
+        return None, []
+
+    token = uuid.uuid4().hex
+    trackings.update_many(
+        {**selector, **query},
+        {
+            "$set": {
+                "lease_owner": INSTANCE_ID,
+                "lease_token": token,
+                "lease_until": now + timedelta(seconds=REFRESH_LEASE_SECONDS),
+            }
+        },
+    )
+
+    claimed = [
+        t["track_no"]
+        for t in trackings.find({"lease_token": token}, {"track_no": 1})
+        if t.get("track_no")
+    ]
+    if candidates:
+        claimed_set = set(claimed)
+        tracking_index.defer([tn for tn in candidates if tn not in claimed_set])
+    return token, claimed
+
+def release_own_leases() -> int:
+    result = trackings.update_many(
+        {"lease_owner": INSTANCE_ID},
+        {"$unset": {"lease_owner": "", "lease_token": "", "lease_until": ""}},
+    )
+    return result.modified_count
+
+def start_sweep_checkpoint() -> dict:
+    checkpoint = sweep_checkpoints.find_one({"_id": INSTANCE_ID})
+
+    if checkpoint and not checkpoint.get("finished"):
+        released = release_own_leases()
+        log.info(
+            "↩️ Resuming interrupted sweep instance=%s cutoff=%s claimed=%d released=%d",
+            INSTANCE_ID,
+            checkpoint["cutoff"],
+            checkpoint.get("claimed", 0),
+            released,
+        )
+        return checkpoint
+
+    now = datetime.utcnow()
+    checkpoint = {
+        "_id": INSTANCE_ID,
+        "cutoff": now,
+        "started_at": now,
+        "claimed": 0,
+        "finished": False,
+    }
+    sweep_checkpoints.replace_one({"_id": INSTANCE_ID}, checkpoint, upsert=True)
+    return checkpoint
+
+def save_sweep_checkpoint(claimed: int, finished: bool = False):
+    sweep_checkpoints.update_one(
+        {"_id": INSTANCE_ID},
+        {"$set": {"claimed": claimed, "finished": finished, "updated_at": datetime.utcnow()}},
+    )
+
+def release_lease(token: str):
+    trackings.update_many(
+        {"lease_token": token},
+        {"$unset": {"lease_owner": "", "lease_token": "", "lease_until": ""}},
+    )
+
+def initial_tracking_doc(track_no: str, data: dict, old: dict) -> dict:
     meta = extract_main_fields(data)
 
-    new_status = meta.get("status_text", "UNKNOWN")
-    time_str = meta.get("time_str", "UNKNOWN")
+    states = merge_states(old.get("states"), meta.get("states"))
+    fps = event_fingerprints(states)
+
+    now = datetime.utcnow()
+    stage, next_check_at = compute_schedule(classify_stage(meta), now, now)
+
+    return {
+        "$set": {
+            "last_status": meta.get("status_text", "UNKNOWN"),
+            "last_update": now,
+            "last_change_at": now,
+            "updated_at": now,
+            "stage": stage,
+            "next_check_at": next_check_at,
+            "origin": meta.get("origin", "UNKNOWN"),
+            "destination": meta.get("destination", "UNKNOWN"),
+            "origin_code": meta.get("origin_code", ""),
+            "destination_code": meta.get("destination_code", ""),
+            "time_str": meta.get("time_str", "UNKNOWN"),
+            "states": states,
+            "event_fps": fps,
+            "event_fps_version": EVENT_FINGERPRINT_VERSION,
+        },
+        "$setOnInsert": {
+            "track_no": track_no,
+            "created_at": now,
+        },
+    }
 
-    trackings.update_one(
-        {"track_no": track_no},
+def fetch_initial_status(track_no: str, chat_id: int):
+    data = cached_query_parcels_track(track_no)
+
+    if not data:
+        return None
+
+    old = trackings.find_one({"track_no": track_no}, {"states": 1}) or {}
+    doc = initial_tracking_doc(track_no, data, old)
+
+    trackings.update_one({"track_no": track_no}, doc, upsert=True)
+    tracking_index.update({track_no: doc["$set"]})
+
+    entry = list_entry_for(track_no, doc["$set"])
+    list_views.update_tracks({track_no: entry})
+    return entry
+
+def store_initial_batch(chat_id: int, found: dict):
+    if not found:
+        return
+
+    old_docs = {
+        tr["track_no"]: tr
+        for tr in trackings.find({"track_no": {"$in": list(found)}}, {"track_no": 1, "states": 1})
+    }
+
+    docs = {
+        track_no: initial_tracking_doc(track_no, data, old_docs.get(track_no) or {})
+        for track_no, data in found.items()
+    }
+    trackings.bulk_write(
+        [UpdateOne({"track_no": track_no}, doc, upsert=True) for track_no, doc in docs.items()],
+        ordered=False,
+    )
+    tracking_index.update({track_no: doc["$set"] for track_no, doc in docs.items()})
+
+    now = datetime.utcnow()
+    subscriptions.bulk_write(
+        [
+            UpdateOne(
+                {"chat_id": chat_id, "track_no": track_no},
+                {
+                    "$set": {
+                        "chat_id": chat_id,
+                        "track_no": track_no,
+                        "created_at": now,
+                    }
+                },
+                upsert=True,
+            )
+            for track_no in found
+        ],
+        ordered=False,
+    )
+    tracking_index.subscribe(chat_id, list(found))
+
+    entries = {track_no: list_entry_for(track_no, doc["$set"]) for track_no, doc in docs.items()}
+    list_views.update_tracks(entries)
+    list_views.set_entries(chat_id, entries)
+
+def remember_user(chat_id: int, from_user: dict):
+    users.update_one(
+        {"chat_id": chat_id},
         {
             "$set": {
-                "last_status": new_status,
-                "last_update": datetime.utcnow(),
-                "origin": meta.get("origin", "UNKNOWN"),
-                "destination": meta.get("destination", "UNKNOWN"),
-                "origin_code": meta.get("origin_code", ""),
-                "destination_code": meta.get("destination_code", ""),
-                "time_str": time_str,
-            },
-            "$setOnInsert": {
-                "track_no": track_no,
-                "created_at": datetime.utcnow(),
+                "chat_id": chat_id,
+                "username": from_user.get("username"),
+                "first_name": from_user.get("first_name"),
+                "updated_at": datetime.utcnow(),
             },
+            "$setOnInsert": {"created_at": datetime.utcnow()},
         },
         upsert=True,
     )
 
-    return True
+def compile_theme_templates(theme: dict) -> dict:
+    return {
+        "message": (
+            f"<b>{theme['header']} {{header}}</b>\n"
+            "📦 <b>Посилка:</b> <code>{track_no}</code>\n"
+            f"{theme['pin']} <b>Статус:</b> {{status}}\n"
+            "\n"
+            f"{theme['route']} <b>Маршрут:</b> {{route}}"
+        ),
+        "message_time": f"<i>{theme['time']} {{time_str}}</i>",
+        "info": (
+            f"<b>{theme['header']} Детальна інформація про посилку</b>\n"
+            "───────────────\n"
+            "📦 <b>Номер:</b> <code>{track_no}</code>\n"
+            f"{theme['pin']} <b>Статус:</b> {{status}}\n"
+            f"{theme['route']} <b>Маршрут:</b> {{route}}\n"
+            "\n"
+            f"<i>{theme['time']} Останнє оновлення: {{time_str}}</i>\n"
+            "\n"
+            "<b>📜 Історія подій:</b>"
+        ),
+    }
 
-def format_message(tracking_number: str, meta: dict, *, initial: bool) -> str:
-    theme = random.choice(EMOJI_THEMES)
+THEME_TEMPLATES = [compile_theme_templates(theme) for theme in EMOJI_THEMES]
+
+@lru_cache(maxsize=10000)
+def render_route(origin, origin_code: str, destination, destination_code: str) -> str:
+    return (
+        f"{get_flag_emoji(origin_code)} {esc(origin)} ➜ "
+        f"{get_flag_emoji(destination_code)} {esc(destination)}"
+    )
+
+@lru_cache(maxsize=50000)
+def render_history_event(ev_time_raw: str, status_text: str, location: str) -> str:
+    ev_time = parse_iso_to_kyiv(ev_time_raw)
+    desc = f"{status_text} ({location})" if location else status_text
+
+    return (
+        f"\n• <b>{esc(ev_time)}</b>\n"
+        f"<blockquote>{esc(desc)}</blockquote>"
+    )
 
-    status = esc(meta.get("status_text", "UNKNOWN"))
-    time_str = esc(meta.get("time_str", "невідомо"))
+def split_message(parts: list, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    chunks = []
+    current = []
+    size = 0
 
-    origin_raw = meta.get("origin", "Unknown")
-    dest_raw = meta.get("destination", "Unknown")
+    for part in parts:
+        part = part[:limit]
+        added = len(part) + (1 if current else 0)
 
-    origin_code = meta.get("origin_code") or ""
-    dest_code = meta.get("destination_code") or ""
+        if current and size + added > limit:
+            chunks.append("\n".join(current).lstrip("\n"))
+            current = [part]
+            size = len(part)
+        else:
+            current.append(part)
+            size += added
+
+    if current:
+        chunks.append("\n".join(current).lstrip("\n"))
 
-    origin = esc(origin_raw)
-    dest = esc(dest_raw)
+    return chunks
+
+def format_message(tracking_number: str, meta: dict, *, initial: bool) -> str:
+    templates = random.choice(THEME_TEMPLATES)
 
     event = meta.get("raw_last_event") or {}
     desc = (
@@ -267,205 +2535,802 @@ def format_message(tracking_number: str, meta: dict, *, initial: bool) -> str:
     header = "ПОЧАТОК МОНІТОРИНГУ" if initial else "ОНОВЛЕННЯ СТАТУСУ"
 
     msg = [
-        f"<b>{theme['header']} {header}</b>",
-        f"📦 <b>Посилка:</b> <code>{esc(tracking_number)}</code>",
-        f"{theme['pin']} <b>Статус:</b> {status}",
-        "",
-        f"{theme['route']} <b>Маршрут:</b> "
-        f"{get_flag_emoji(origin_code)} {origin} ➜ {get_flag_emoji(dest_code)} {dest}",
+        templates["message"].format(
+            header=header,
+            track_no=esc(tracking_number),
+            status=esc(meta.get("status_text", "UNKNOWN")),
+            route=render_route(
+                meta.get("origin", "Unknown"),
+                meta.get("origin_code") or "",
+                meta.get("destination", "Unknown"),
+                meta.get("destination_code") or "",
+            ),
+        )
     ]
 
     if desc:
         msg.append(f"<blockquote>{esc(desc)}</blockquote>")
 
-    msg.append(f"<i>{theme['time']} {time_str}</i>")
+    msg.append(templates["message_time"].format(time_str=esc(meta.get("time_str", "невідомо"))))
 
     return "\n".join(msg)
 
-def format_detailed_info(track_no: str, meta: dict, history: list) -> str:
-    theme = random.choice(EMOJI_THEMES)
-
-    status = esc(meta.get("status_text", "UNKNOWN"))
-    time_str = esc(meta.get("time_str", "невідомо"))
-
-    origin_raw = meta.get("origin", "Unknown")
-    dest_raw = meta.get("destination", "Unknown")
-    origin_code = meta.get("origin_code") or ""
-    dest_code = meta.get("destination_code") or ""
-
-    origin = esc(origin_raw)
-    dest = esc(dest_raw)
+def format_detailed_info_parts(track_no: str, meta: dict, history: list) -> list:
+    templates = random.choice(THEME_TEMPLATES)
 
     msg = [
-        f"<b>{theme['header']} Детальна інформація про посилку</b>",
-        "───────────────",
-        f"📦 <b>Номер:</b> <code>{esc(track_no)}</code>",
-        f"{theme['pin']} <b>Статус:</b> {status}",
-        f"{theme['route']} <b>Маршрут:</b> "
-        f"{get_flag_emoji(origin_code)} {origin} ➜ {get_flag_emoji(dest_code)} {dest}",
-        "",
-        f"<i>{theme['time']} Останнє оновлення: {time_str}</i>",
-        "",
-        "<b>📜 Історія подій:</b>",
+        templates["info"].format(
+            track_no=esc(track_no),
+            status=esc(meta.get("status_text", "UNKNOWN")),
+            route=render_route(
+                meta.get("origin", "Unknown"),
+                meta.get("origin_code") or "",
+                meta.get("destination", "Unknown"),
+                meta.get("destination_code") or "",
+            ),
+            time_str=esc(meta.get("time_str", "невідомо")),
+        )
     ]
 
     if not history:
         msg.append("Немає даних про історію.")
-        return "\n".join(msg)
+        return msg
 
     for ev in history:
-        ev_time_raw = ev.get("date") or ev.get("time") or "???"
-        ev_time = parse_iso_to_kyiv(ev_time_raw)
-
-        status_text = (
-            ev.get("status")
-            or ev.get("description")
-            or ev.get("message")
-            or "Немає опису"
+        msg.append(
+            render_history_event(
+                ev.get("date") or ev.get("time") or "???",
+                ev.get("status")
+                or ev.get("description")
+                or ev.get("message")
+                or "Немає опису",
+                ev.get("location") or "",
+            )
         )
-        location = ev.get("location") or ""
-        if location:
-            desc = f"{status_text} ({location})"
+
+    return msg
+
+def format_detailed_info(track_no: str, meta: dict, history: list) -> str:
+    return "\n".join(format_detailed_info_parts(track_no, meta, history))
+
+def format_detailed_info_chunks(track_no: str, meta: dict, history: list) -> list:
+    return split_message(format_detailed_info_parts(track_no, meta, history))
+
+@lru_cache(maxsize=20000)
+def render_list_entry(track_no: str, status, time_str, origin, origin_code: str, destination, destination_code: str) -> str:
+    return (
+        f"• <code>{esc(track_no)}</code>\n"
+        f"  🏷 {esc(status)}\n"
+        f"  🌍 {render_route(origin, origin_code, destination, destination_code)}\n"
+        f"  ⏱ <i>{esc(time_str)}</i>\n"
+    )
+
+def render_digest(items: list) -> list:
+    latest = OrderedDict()
+    for item in items:
+        latest.pop(item["track_no"], None)
+        latest[item["track_no"]] = item["text"]
+
+    parts = [f"<b>📬 Зведення оновлень: {len(latest)} {parcels_word(len(latest))}</b>"]
+    for text in latest.values():
+        parts.append("")
+        parts.append(text)
+
+    return split_message(parts)
+
+def parcels_word(n: int) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return "посилка"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return "посилки"
+    return "посилок"
+
+def render_list_page(items: list, page: int, pages: int) -> list:
+    if pages > 1:
+        lines = [f"📦 <b>Ваші посилки</b> (сторінка {page}/{pages}):", ""]
+    else:
+        lines = ["📦 <b>Ваші посилки:</b>", ""]
+
+    lines.extend(items)
+
+    if page < pages:
+        lines.append(f"Далі: <b>/list {page + 1}</b>")
+
+    return lines
+
+def render_track_progress(progress: dict, *, finished: bool) -> list:
+    lines = [
+        "✅ <b>Перевірку завершено</b>" if finished else "⏳ <b>Перевіряю посилки...</b>",
+        f"Оброблено: {progress['checked']}/{progress['total']}",
+    ]
+
+    if progress["skipped"]:
+        lines.append(f"⚠️ Взято перші {progress['total']} номерів, решту ({progress['skipped']}) пропущено.")
+
+    for key, title in (
+        ("added", "🟢 Відстежую"),
+        ("known", "ℹ️ Вже відстежуються"),
+        ("missing", "❌ Не знайдено через Parcels"),
+        ("unavailable", "⚠️ Parcels зараз недоступний, спробуй ці номери пізніше"),
+    ):
+        if progress[key]:
+            lines.append("")
+            lines.append(f"{title} ({len(progress[key])}):")
+            lines.extend(f"• <code>{esc(tn)}</code>" for tn in progress[key])
+
+    if finished:
+        lines.append("")
+        lines.append("Подивитися всі посилки: <b>/list</b>")
+
+    return lines
+
+def plan_tracking_update(track_no: str, data: dict, old: dict) -> tuple:
+    meta = extract_main_fields(data)
+    new_status = meta.get("status_text", "UNKNOWN")
+    time_str = meta.get("time_str", "невідомо")
+
+    if new_status == "UNKNOWN":
+        log.info("⚠️ Status became UNKNOWN for %s, skipping update", track_no)
+        return None, None, None, None
+
+    old_status = old.get("last_status")
+    old_states = old.get("states") or []
+    old_fps = stored_fingerprints(old)
+    has_history = "states" in old
+
+    fresh_states = [normalize_state(ev) for ev in meta.get("states") or []]
+    new_events = [ev for ev, fp in zip(fresh_states, event_fingerprints(fresh_states)) if fp not in old_fps]
+    status_changed = old_status != new_status
+    now = datetime.utcnow()
+
+    if has_history and not new_events and not status_changed:
+        last_change_at = old.get("last_change_at") or old.get("last_update") or old.get("created_at")
+        stage, next_check_at = compute_schedule(classify_stage(meta), last_change_at, now)
+        fields = {
+            "stage": stage,
+            "next_check_at": next_check_at,
+            "last_checked_at": now,
+            "updated_at": now,
+        }
+        return UpdateOne({"track_no": track_no}, {"$set": fields}), None, None, fields
+
+    states = merge_states(old_states, fresh_states)
+    stage, next_check_at = compute_schedule(classify_stage(meta), now, now)
+
+    fields = {
+        "last_status": new_status,
+        "last_update": now,
+        "last_change_at": now,
+        "last_checked_at": now,
+        "updated_at": now,
+        "stage": stage,
+        "next_check_at": next_check_at,
+        "origin": meta.get("origin", "Unknown"),
+        "destination": meta.get("destination", "Unknown"),
+        "origin_code": meta.get("origin_code", ""),
+        "destination_code": meta.get("destination_code", ""),
+        "time_str": time_str,
+        "states": states,
+        "event_fps": event_fingerprints(states),
+        "event_fps_version": EVENT_FINGERPRINT_VERSION,
+    }
+    entry = list_entry_for(track_no, fields)
+
+    if has_history:
+        if not new_events:
+            return UpdateOne({"track_no": track_no}, {"$set": fields}, upsert=True), None, entry, fields
+        meta["raw_last_event"] = max(new_events, key=lambda ev: ev.get("date") or "")
+    elif not status_changed:
+        return UpdateOne({"track_no": track_no}, {"$set": fields}, upsert=True), None, entry, fields
+
+    metrics.inc("parcel_changes_total")
+    log.info("🟢 Оновлення статусу %s: %s → %s (%d нових подій)", track_no, old_status, new_status, len(new_events))
+
+    fields["notice_at"] = now
+    op = UpdateOne(
+        {"track_no": track_no},
+        {
+            "$set": fields,
+            "$push": {
+                "pending_notices": {
+                    "id": uuid.uuid4().hex,
+                    "text": format_message(track_no, meta, initial=False),
+                    "at": now,
+                }
+            },
+        },
+        upsert=True,
+    )
+    return op, meta, entry, fields
+
+def apply_tracking_update(track_no: str, data: dict, old: dict = None):
+    if old is None:
+        old = trackings.find_one({"track_no": track_no}, TRACKING_STATE_FIELDS) or {}
+
+    op, meta, entry, fields = plan_tracking_update(track_no, data, old)
+    if op is None:
+        return
+
+    trackings.bulk_write([op])
+    tracking_index.update({track_no: fields})
+
+    if entry:
+        list_views.update_tracks({track_no: entry})
+
+def begin_chunk_refresh(chunk: list, token: str, done: Future):
+    log.debug("➡️ Перевіряю %d посилок", len(chunk), extra=SAMPLED)
+
+    try:
+        lookup = submit_parcels_batch(chunk)
+    except Exception as e:
+        tracking_index.defer(chunk)
+        release_lease(token)
+        done.set_exception(e)
+        return
+
+    lookup.add_done_callback(
+        lambda f: refresh_executor.submit(complete_chunk_refresh, chunk, token, f, done)
+    )
+
+def complete_chunk_refresh(chunk: list, token: str, lookup: Future, done: Future):
+    try:
+        try:
+            store_chunk_results(chunk, lookup.result())
+        except CircuitOpenError as e:
+            tracking_index.defer(chunk)
+            log.debug("⏸ %d parcels stay due: %s", len(chunk), e, extra=SAMPLED)
+        except Exception:
+            tracking_index.defer(chunk)
+            raise
+        finally:
+            release_lease(token)
+    except Exception as e:
+        done.set_exception(e)
+    else:
+        done.set_result(None)
+
+def store_chunk_results(chunk: list, results: dict):
+    found = [tn for tn in chunk if tn in results]
+    old_docs = {
+        tr["track_no"]: tr
+        for tr in trackings.find({"track_no": {"$in": found}}, TRACKING_STATE_FIELDS)
+    } if found else {}
+
+    ops = []
+    entries = {}
+    changes = {}
+    fetched = {}
+    now = datetime.utcnow()
+    retry_fields = {"next_check_at": now + SCHEDULE_RETRY_INTERVAL, "updated_at": now}
+
+    for track_no in chunk:
+        shipment = results.get(track_no)
+        op = entry = None
+
+        if shipment:
+            data = fetched[track_no] = {"shipments": [shipment]}
+            op, _, entry, fields = plan_tracking_update(track_no, data, old_docs.get(track_no, {}))
         else:
-            desc = status_text
+            log.debug("⚠️ Parcels не повернув даних для %s", track_no, extra=SAMPLED)
+
+        if op is None:
+            fields = retry_fields
+            op = UpdateOne({"track_no": track_no}, {"$set": fields})
+
+        ops.append(op)
+        changes[track_no] = fields
+        if entry:
+            entries[track_no] = entry
+
+    parcels_cache.put_many(fetched)
+
+    if ops:
+        trackings.bulk_write(ops, ordered=False)
+
+    tracking_index.update(changes)
+    list_views.update_tracks(entries)
+
+def run_refresh_sweep() -> int:
+    started = time.perf_counter()
+    checkpoint = start_sweep_checkpoint()
+    cutoff = checkpoint["cutoff"]
+
+    tracking_index.sync()
+    backlog = tracking_index.due_count(cutoff)
+    if backlog is None:
+        backlog = trackings.count_documents(claimable_trackings_query(cutoff, datetime.utcnow()))
+    metrics.set("refresh_backlog", backlog)
+
+    log.info("🔄 Parcels auto-refresh started instance=%s due=%d", INSTANCE_ID, backlog)
+    log.info("Parcels cache: %s", parcels_cache.stats())
+
+    window = max(1, REFRESH_CONCURRENCY)
+    slots = threading.BoundedSemaphore(window)
+    claimed_total = checkpoint.get("claimed", 0)
+
+    def chunk_finished(done: Future):
+        slots.release()
+        error = done.exception()
+        if error:
+            log.error("refresh_chunk exception: %r", error)
+
+    paused = False
+
+    while not refresh_stop.is_set():
+        pause = parcels_breaker.retry_in()
+        if pause > 0:
+            if not paused:
+                log.warning("⏸ Parcels is unavailable, refresh paused instance=%s", INSTANCE_ID)
+                paused = True
+            refresh_stop.wait(pause)
+            continue
 
-        msg.append(
-            f"\n• <b>{esc(ev_time)}</b>\n"
-            f"<blockquote>{esc(desc)}</blockquote>"
-        )
+        if paused:
+            log.info("▶️ Parcels refresh resumed instance=%s", INSTANCE_ID)
+            paused = False
 
-    return "\n".join(msg)
+        slots.acquire()
+
+        try:
+            token, chunk = claim_due_batch(PARCELS_BATCH_SIZE, cutoff)
+        except Exception as e:
+            log.exception("claim_due_batch exception: %r", e)
+            token, chunk = None, []
+
+        if token is None or not chunk:
+            slots.release()
+            if token is None:
+                break
+            continue
+
+        claimed_total += len(chunk)
+        save_sweep_checkpoint(claimed_total)
+
+        done = Future()
+        done.add_done_callback(chunk_finished)
+        refresh_executor.submit(begin_chunk_refresh, chunk, token, done)
+
+    for _ in range(window):
+        slots.acquire()
+    for _ in range(window):
+        slots.release()
+
+    save_sweep_checkpoint(claimed_total, finished=not refresh_stop.is_set())
+    tracking_index.requeue()
+    tracking_index.save_snapshot()
+
+    metrics.set("refresh_sweep_seconds", time.perf_counter() - started)
+    metrics.inc("refresh_parcels_total", claimed_total)
+    log.info("✅ Parcels auto-refresh finished instance=%s claimed=%d seconds=%.1f", INSTANCE_ID, claimed_total, time.perf_counter() - started)
+
+    return claimed_total
 
 def refresh_all_trackings():
     if not PARCELS_API_KEY:
-        print("❌ No PARCELS_API_KEY set — refresh aborted")
+        log.error("❌ No PARCELS_API_KEY set — refresh aborted")
         return
 
-    all_tracks = list(trackings.find({}, {"track_no": 1}))
+    try:
+        run_refresh_sweep()
+    except Exception as e:
+        log.exception("refresh_all_trackings exception: %r", e)
+
+def refresh_scheduler():
+    while not refresh_stop.is_set():
+        refresh_all_trackings()
+        refresh_stop.wait(REFRESH_INTERVAL)
+
+def start_refresh_scheduler():
+    threading.Thread(target=refresh_scheduler, name="refresh-scheduler", daemon=True).start()
+
+def pending_notices_query(now: datetime) -> dict:
+    return {
+        "$or": [
+            {"notice_at": {"$exists": True}},
+            {"notice_claim_at": {"$lt": now - NOTIFIER_CLAIM_TIMEOUT}},
+        ]
+    }
 
-    print(f"🔄 Parcels auto-refresh started, {len(all_tracks)} trackings")
+def claim_notices(tracking_ids: list) -> tuple:
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
 
-    for t in all_tracks:
-        track_no = t.get("track_no")
-        if not track_no:
-            continue
+    trackings.update_many(
+        {"_id": {"$in": tracking_ids}, **pending_notices_query(now)},
+        {
+            "$set": {"notice_claim": token, "notice_claim_at": now},
+            "$unset": {"notice_at": ""},
+        },
+    )
 
-        print(f"➡️ Перевіряю {track_no}")
+    claimed = {
+        t["track_no"]: t.get("pending_notices") or []
+        for t in trackings.find({"notice_claim": token}, {"track_no": 1, "pending_notices": 1})
+        if t.get("track_no")
+    }
+    return token, claimed
 
-        data = query_parcels_track(track_no)
-        if not data:
-            print(f"⚠️ Parcels не повернув даних для {track_no}")
-            continue
+def release_notices(token: str, notice_ids: list, complete: bool = True):
+    update = {
+        "$pull": {"pending_notices": {"id": {"$in": notice_ids}}},
+        "$unset": {"notice_claim": "", "notice_claim_at": ""},
+    }
+    if not complete:
+        update["$set"] = {"notice_at": datetime.utcnow()}
 
-        meta = extract_main_fields(data)
-        new_status = meta.get("status_text", "UNKNOWN")
-        time_str = meta.get("time_str", "невідомо")
+    trackings.update_many({"notice_claim": token}, update)
 
-        if new_status == "UNKNOWN":
-            print(f"⚠️ Status became UNKNOWN for {track_no}, skipping update")
-            continue
+def deliver_notices(tracking_ids: list) -> int:
+    token, claimed = claim_notices(tracking_ids)
+    if not claimed:
+        return 0
 
-        old = trackings.find_one({"track_no": track_no})
-        old_status = old.get("last_status") if old else None
+    sent = 0
+    notice_ids = []
+    digested_ids = []
+    digest_ops = []
+    total = sum(len(notices) for notices in claimed.values())
+    now = datetime.utcnow()
 
-        if old_status == new_status:
-            continue
+    try:
+        chat_ids_by_track = {}
+        for s in subscriptions.find({"track_no": {"$in": list(claimed)}}, {"chat_id": 1, "track_no": 1}):
+            chat_ids_by_track.setdefault(s["track_no"], []).append(s["chat_id"])
+
+        chat_ids = {chat_id for ids in chat_ids_by_track.values() for chat_id in ids}
+        digest_windows = {
+            u["chat_id"]: u["digest_minutes"]
+            for u in users.find(
+                {"chat_id": {"$in": list(chat_ids)}, "digest_minutes": {"$gt": 0}},
+                {"chat_id": 1, "digest_minutes": 1},
+            )
+        } if chat_ids else {}
+
+        for track_no, notices in claimed.items():
+            for notice in sorted(notices, key=lambda n: n.get("at") or datetime.min):
+                digested = False
+                for chat_id in chat_ids_by_track.get(track_no, []):
+                    window = digest_windows.get(chat_id)
+                    if window:
+                        digested = True
+                        digest_ops.append(
+                            UpdateOne(
+                                {"_id": chat_id},
+                                {
+                                    "$push": {"items": {"track_no": track_no, "text": notice["text"], "at": now}},
+                                    "$setOnInsert": {"due_at": now + timedelta(minutes=window)},
+                                },
+                                upsert=True,
+                            )
+                        )
+                    else:
+                        send_telegram(chat_id, notice["text"])
+                        sent += 1
+                (digested_ids if digested else notice_ids).append(notice["id"])
+
+        if digest_ops:
+            digests.bulk_write(digest_ops, ordered=False)
+        notice_ids += digested_ids
+    finally:
+        release_notices(token, notice_ids, complete=len(notice_ids) >= total)
+
+    metrics.inc("notices_delivered_total", len(notice_ids))
+    metrics.inc("notice_messages_total", sent)
+    metrics.inc("digest_items_total", len(digest_ops))
+    return sent
+
+def flush_due_digests(now: datetime = None) -> int:
+    flushed = 0
+    while True:
+        digest = digests.find_one_and_delete(
+            {"due_at": {"$lte": now or datetime.utcnow()}},
+            sort=[("due_at", 1)],
+        )
+        if not digest:
+            return flushed
+
+        send_digest(digest)
+        flushed += 1
+
+def send_digest(digest: dict):
+    chunks = render_digest(digest.get("items") or [])
+    for chunk in chunks:
+        send_telegram(digest["_id"], chunk)
+
+    metrics.inc("digests_sent_total")
+    metrics.inc("digest_messages_total", len(chunks))
+
+def digest_flusher():
+    while True:
+        try:
+            flush_due_digests()
+        except Exception as e:
+            log.exception("digest_flusher exception: %r", e)
+
+        time.sleep(DIGEST_POLL_INTERVAL)
+
+def scan_pending_notices() -> int:
+    total = 0
+    while True:
+        ids = [
+            t["_id"]
+            for t in trackings.find(pending_notices_query(datetime.utcnow()), {"_id": 1}).limit(NOTIFIER_BATCH_SIZE)
+        ]
+        if not ids:
+            return total
+
+        total += len(ids)
+        deliver_notices(ids)
+
+def save_resume_token(token):
+    notifier_state.update_one(
+        {"_id": "trackings"},
+        {"$set": {"resume_token": token, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
 
-        print(f"🟢 Оновлення статусу {track_no}: {old_status} → {new_status}")
+def watch_notices():
+    state = notifier_state.find_one({"_id": "trackings"}) or {}
+    pipeline = [
+        {
+            "$match": {
+                "$or": [
+                    {"updateDescription.updatedFields.notice_at": {"$exists": True}},
+                    {"fullDocument.notice_at": {"$exists": True}},
+                ]
+            }
+        },
+        {"$project": {"documentKey": 1}},
+    ]
 
-        trackings.update_one(
-            {"track_no": track_no},
-            {
-                "$set": {
-                    "last_status": new_status,
-                    "last_update": datetime.utcnow(),
-                    "origin": meta.get("origin", "Unknown"),
-                    "destination": meta.get("destination", "Unknown"),
-                    "origin_code": meta.get("origin_code", ""),
-                    "destination_code": meta.get("destination_code", ""),
-                    "time_str": time_str,
-                }
-            },
-            upsert=True,
+    with trackings.watch(
+        pipeline,
+        resume_after=state.get("resume_token"),
+        batch_size=NOTIFIER_BATCH_SIZE,
+    ) as stream:
+        notifier_streaming.set()
+        log.info("📡 Notifier watching trackings change stream")
+        scan_pending_notices()
+        scanned_at = time.monotonic()
+
+        while stream.alive:
+            if time.monotonic() - scanned_at >= NOTIFIER_CLAIM_TIMEOUT.total_seconds():
+                scan_pending_notices()
+                scanned_at = time.monotonic()
+
+            batch = []
+            while len(batch) < NOTIFIER_BATCH_SIZE:
+                change = stream.try_next()
+                if change is None:
+                    break
+                batch.append(change["documentKey"]["_id"])
+
+            if batch:
+                deliver_notices(batch)
+                save_resume_token(stream.resume_token)
+
+def poll_notices():
+    log.info("📡 Notifier polling trackings every %.1fs", NOTIFIER_POLL_INTERVAL)
+    while True:
+        try:
+            if not scan_pending_notices():
+                time.sleep(NOTIFIER_POLL_INTERVAL)
+        except Exception as e:
+            log.exception("poll_notices exception: %r", e)
+            time.sleep(NOTIFIER_POLL_INTERVAL)
+
+def notifier():
+    while NOTIFIER_MODE in ("auto", "changestream"):
+        try:
+            watch_notices()
+        except OperationFailure as e:
+            if e.code in CHANGE_STREAM_HISTORY_LOST_CODES:
+                log.warning("⚠️ Notifier resume token expired, rescanning pending notices")
+                save_resume_token(None)
+                continue
+            if e.code in CHANGE_STREAM_UNSUPPORTED_CODES and NOTIFIER_MODE == "auto":
+                log.warning("⚠️ Change streams not available (%s), notifier falls back to polling", e.code)
+                break
+            log.exception("notifier exception: %r", e)
+        except Exception as e:
+            if NOTIFIER_MODE == "auto" and not notifier_streaming.is_set():
+                log.warning("⚠️ Change streams not available (%r), notifier falls back to polling", e)
+                break
+            log.exception("notifier exception: %r", e)
+
+        time.sleep(NOTIFIER_POLL_INTERVAL)
+
+    poll_notices()
+
+def start_notifier():
+    global notifier_started
+
+    with notifier_lock:
+        if notifier_started:
+            return
+
+        notifier_started = True
+        threading.Thread(target=notifier, name="notifier", daemon=True).start()
+        threading.Thread(target=digest_flusher, name="digest-flusher", daemon=True).start()
+
+def edit_track_progress(chat_id: int, message_id, progress: dict, *, finished: bool):
+    chunks = split_message(render_track_progress(progress, finished=finished))
+
+    if message_id is None:
+        if finished:
+            for chunk in chunks:
+                send_telegram(chat_id, chunk)
+        return
+
+    telegram_call(
+        "editMessageText",
+        {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "text": chunks[0],
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True,
+        },
+    )
+
+    if finished:
+        for chunk in chunks[1:]:
+            send_telegram(chat_id, chunk)
+
+def track_many(chat_id: int, from_user: dict, track_nos: list):
+    skipped = max(0, len(track_nos) - TRACK_BULK_LIMIT)
+    track_nos = track_nos[:TRACK_BULK_LIMIT]
+
+    maybe_known = tracking_index.subscribed_among(chat_id, track_nos)
+    if maybe_known is None:
+        maybe_known = track_nos
+
+    known = {
+        s["track_no"]
+        for s in subscriptions.find(
+            {"chat_id": chat_id, "track_no": {"$in": list(maybe_known)}},
+            {"track_no": 1},
         )
+    } if maybe_known else set()
+    pending = [tn for tn in track_nos if tn not in known]
+
+    progress = {
+        "total": len(track_nos),
+        "checked": len(known),
+        "skipped": skipped,
+        "added": [],
+        "known": [tn for tn in track_nos if tn in known],
+        "missing": [],
+        "unavailable": [],
+    }
 
-        subs = list(subscriptions.find({"track_no": track_no}))
-        if not subs:
-            continue
+    sent = telegram_call(
+        "sendMessage",
+        {
+            "chat_id": chat_id,
+            "text": split_message(render_track_progress(progress, finished=not pending))[0],
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True,
+        },
+    )
+    message_id = sent.get("message_id") if sent else None
 
-        msg = format_message(track_no, meta, initial=False)
-        for s in subs:
-            send_telegram(s["chat_id"], msg)
+    if not pending:
+        if message_id is None:
+            edit_track_progress(chat_id, None, progress, finished=True)
+        return
 
-    threading.Timer(REFRESH_INTERVAL, refresh_all_trackings).start()
+    remember_user(chat_id, from_user)
 
-@app.post("/telegram-webhook")
-def telegram_webhook():
-    try:
-        update = request.get_json(silent=True) or {}
+    cached = {}
+    lookups = []
+    for track_no in pending:
+        data = parcels_cache.peek(track_no)
+        if data:
+            cached[track_no] = data
+        else:
+            lookups.append(track_no)
+
+    futures = {submit_parcels_batch(chunk): chunk for chunk in chunked(lookups, PARCELS_BATCH_SIZE)}
+    if cached:
+        done = Future()
+        done.set_result({})
+        futures[done] = list(cached)
+
+    for future in as_completed(futures, timeout=PARCELS_POLL_DEADLINE + 60):
+        chunk = futures[future]
+        found = {tn: cached[tn] for tn in chunk if tn in cached}
+
+        try:
+            shipments = future.result()
+        except CircuitOpenError:
+            shipments = {}
+            progress["unavailable"].extend(tn for tn in chunk if tn not in found)
+
+        fetched = {track_no: {"shipments": [shipment]} for track_no, shipment in shipments.items()}
+        parcels_cache.put_many(fetched)
+        found.update(fetched)
+
+        try:
+            store_initial_batch(chat_id, found)
+        except Exception as e:
+            log.exception("track_many store error: %r", e)
+            found = {}
+
+        progress["checked"] += len(chunk)
+        progress["added"].extend(tn for tn in chunk if tn in found)
+        progress["missing"].extend(
+            tn for tn in chunk if tn not in found and tn not in progress["unavailable"]
+        )
 
+        edit_track_progress(chat_id, message_id, progress, finished=progress["checked"] >= progress["total"])
+
+def handle_update(update: dict):
+    try:
         message = update.get("message") or update.get("edited_message") or {}
-        text = (message.get("text") or "").strip()
+        text = (message.get("text") or message.get("caption") or "").strip()
+        document = message.get("document")
         chat = message.get("chat") or {}
         from_user = message.get("from") or {}
 
         chat_id = chat.get("id")
 
-        if not chat_id or not text:
-            return jsonify({"ok": True})
+        if not chat_id or not (text or document):
+            return
 
-        parts = text.split(maxsplit=1)
+        parts = text.split(maxsplit=1) if text else ["/track"]
         cmd = parts[0].lower()
         arg_raw = parts[1] if len(parts) > 1 else ""
         arg = sanitize_tracking_number(arg_raw) if arg_raw else ""
 
+        if document and cmd == "/track":
+            mime_type = (document.get("mime_type") or "").lower()
+            file_name = (document.get("file_name") or "").lower()
+
+            if mime_type not in TRACK_DOCUMENT_TYPES and not file_name.endswith((".txt", ".csv")):
+                send_telegram(chat_id, "❗ Надішли номери текстовим файлом <b>.txt</b> або <b>.csv</b>.")
+                return
+
+            if (document.get("file_size") or 0) > TRACK_DOCUMENT_MAX_BYTES:
+                send_telegram(chat_id, "❗ Файл завеликий, розбий його на кілька частин.")
+                return
+
+            content = download_telegram_document(document)
+            if content is None:
+                send_telegram(chat_id, "⚠️ Не вдалося завантажити файл, спробуй ще раз.")
+                return
+
+            arg_raw = f"{arg_raw}\n{content}"
+            arg = sanitize_tracking_number(arg_raw)
+
         if cmd == "/start":
             send_telegram(
                 chat_id,
                 "Привіт! Я бот для відстеження посилок 📦\n\n"
                 "Доступні команди:\n"
-                "• <b>/track</b> <i>НОМЕР</i> — почати відстежувати посилку\n"
-                "• <b>/list</b> — список всіх ваших посилок\n"
+                "• <b>/track</b> <i>НОМЕР</i> — почати відстежувати посилку "
+                "(можна кілька номерів через пробіл, кому чи з нового рядка, або файл .txt/.csv)\n"
+                "• <b>/list</b> — список всіх ваших посилок (<b>/list</b> <i>2</i> — наступна сторінка)\n"
                 "• <b>/untrack</b> <i>НОМЕР</i> — припинити відстеження\n"
-                "• <b>/info</b> <i>НОМЕР</i> — детальна інформація та історія подій",
+                "• <b>/info</b> <i>НОМЕР</i> — детальна інформація та історія подій\n"
+                "• <b>/info</b> <i>НОМЕР</i> refresh — те саме, але зі свіжим запитом до Parcels\n"
+                "• <b>/digest</b> <i>ХВИЛИН</i> — збирати оновлення в одне повідомлення раз на N хвилин "
+                "(<b>/digest</b> off — вимкнути)",
             )
 
         elif cmd == "/list":
-            subs = list(subscriptions.find({"chat_id": chat_id}))
+            page = int(arg_raw) if arg_raw.strip().isdigit() else 1
+            items, page, pages = list_views.page(chat_id, page, LIST_PAGE_SIZE, load_list_entries)
 
-            if not subs:
+            if not items:
                 send_telegram(
                     chat_id,
                     "📭 Ви ще не відстежуєте жодної посилки.\n"
                     "Додайте посилку командою:\n<b>/track</b> <i>НОМЕР</i>",
                 )
             else:
-                track_nos = sorted({s["track_no"] for s in subs if s.get("track_no")})
-                tracks_cursor = trackings.find({"track_no": {"$in": track_nos}})
-                tracks_map = {t["track_no"]: t for t in tracks_cursor}
-
-                lines = ["📦 <b>Ваші посилки:</b>", ""]
-
-                for tn in track_nos:
-                    tr = tracks_map.get(tn, {})
-                    status = tr.get("last_status", "статус ще невідомий")
-                    time_str = tr.get("time_str") or "час невідомий"
-                    origin_raw = tr.get("origin", "Unknown")
-                    dest_raw = tr.get("destination", "Unknown")
-                    origin_code = tr.get("origin_code") or ""
-                    dest_code = tr.get("destination_code") or ""
-                    origin = esc(origin_raw)
-                    dest = esc(dest_raw)
-
-                    lines.append(
-                        f"• <code>{esc(tn)}</code>\n"
-                        f"  🏷 {esc(status)}\n"
-                        f"  🌍 {get_flag_emoji(origin_code)} {origin} ➜ "
-                        f"{get_flag_emoji(dest_code)} {dest}\n"
-                        f"  ⏱ <i>{esc(time_str)}</i>\n"
-                    )
-
-                send_telegram(chat_id, "\n".join(lines))
+                for chunk in split_message(render_list_page(items, page, pages)):
+                    send_telegram(chat_id, chunk)
 
         elif cmd == "/untrack":
             if not arg:
@@ -483,9 +3348,11 @@ def telegram_webhook():
                         f"ℹ️ Ви не відстежували посилку <i>{esc(track_no)}</i>.",
                     )
                 else:
+                    list_views.remove_entry(chat_id, track_no)
                     remaining = subscriptions.count_documents({"track_no": track_no})
                     if remaining == 0:
                         trackings.delete_one({"track_no": track_no})
+                    tracking_index.forget(chat_id, track_no, tracking_removed=remaining == 0)
 
                     send_telegram(
                         chat_id,
@@ -493,17 +3360,26 @@ def telegram_webhook():
                     )
 
         elif cmd == "/track":
+            track_nos = parse_tracking_numbers(arg_raw)
+
             if not arg:
                 send_telegram(
                     chat_id,
                     "❗ Формат: <b>/track</b> <i>ABCD0123456789</i>",
                 )
+            elif len(track_nos) > 1 or document:
+                if not track_nos:
+                    send_telegram(chat_id, "❗ У файлі не знайдено жодного номера посилки.")
+                else:
+                    track_many(chat_id, from_user, track_nos)
             else:
-                track_no = arg
+                track_no = track_nos[0] if track_nos else arg
 
-                existing_sub = subscriptions.find_one(
-                    {"chat_id": chat_id, "track_no": track_no}
-                )
+                existing_sub = None
+                if tracking_index.is_subscribed(chat_id, track_no) is not False:
+                    existing_sub = subscriptions.find_one(
+                        {"chat_id": chat_id, "track_no": track_no}
+                    )
 
                 if existing_sub:
                     tr = trackings.find_one({"track_no": track_no}) or {}
@@ -517,28 +3393,24 @@ def telegram_webhook():
                         "Подивитися всі посилки: <b>/list</b>",
                     )
                 else:
-                    success = fetch_initial_status(track_no, chat_id)
+                    try:
+                        entry = fetch_initial_status(track_no, chat_id)
+                    except CircuitOpenError:
+                        send_telegram(
+                            chat_id,
+                            "⚠️ Parcels зараз недоступний.\n"
+                            "Спробуй додати посилку трохи пізніше.",
+                        )
+                        return
 
-                    if not success:
+                    if not entry:
                         send_telegram(
                             chat_id,
                             "❌ Не вдалося знайти таку посилку через Parcels.\n"
                             "Перевір, чи правильно введений номер!",
                         )
                     else:
-                        users.update_one(
-                            {"chat_id": chat_id},
-                            {
-                                "$set": {
-                                    "chat_id": chat_id,
-                                    "username": from_user.get("username"),
-                                    "first_name": from_user.get("first_name"),
-                                    "updated_at": datetime.utcnow(),
-                                },
-                                "$setOnInsert": {"created_at": datetime.utcnow()},
-                            },
-                            upsert=True,
-                        )
+                        remember_user(chat_id, from_user)
 
                         trackings.update_one(
                             {"track_no": track_no},
@@ -562,6 +3434,8 @@ def telegram_webhook():
                             },
                             upsert=True,
                         )
+                        tracking_index.subscribe(chat_id, [track_no])
+                        list_views.set_entries(chat_id, {track_no: entry})
 
                         send_telegram(
                             chat_id,
@@ -570,6 +3444,46 @@ def telegram_webhook():
                             f"Деталі: <b>/info</b> <i>{esc(track_no)}</i>",
                         )
 
+        elif cmd == "/digest":
+            choice = arg_raw.strip().lower()
+
+            if not choice:
+                user = users.find_one({"chat_id": chat_id}, {"digest_minutes": 1}) or {}
+                minutes = user.get("digest_minutes") or 0
+                send_telegram(
+                    chat_id,
+                    (
+                        f"📬 Зведення увімкнене: раз на {minutes} хв.\n"
+                        if minutes
+                        else "📬 Зведення вимкнене, кожне оновлення приходить окремо.\n"
+                    )
+                    + "Формат: <b>/digest</b> <i>30</i> або <b>/digest</b> off",
+                )
+            elif choice in DIGEST_OFF_WORDS:
+                users.update_one(
+                    {"chat_id": chat_id},
+                    {"$set": {"digest_minutes": 0, "updated_at": datetime.utcnow()}},
+                    upsert=True,
+                )
+                digest = digests.find_one_and_delete({"_id": chat_id})
+                if digest:
+                    send_digest(digest)
+                send_telegram(chat_id, "🔔 Зведення вимкнене, оновлення знову приходитимуть одразу.")
+            elif choice in DIGEST_ON_WORDS or choice.isdigit():
+                minutes = DIGEST_DEFAULT_MINUTES if choice in DIGEST_ON_WORDS else int(choice)
+                minutes = min(max(1, minutes), DIGEST_MAX_MINUTES)
+                users.update_one(
+                    {"chat_id": chat_id},
+                    {
+                        "$set": {"digest_minutes": minutes, "updated_at": datetime.utcnow()},
+                        "$setOnInsert": {"created_at": datetime.utcnow()},
+                    },
+                    upsert=True,
+                )
+                send_telegram(chat_id, f"📬 Надсилатиму оновлення одним зведенням раз на {minutes} хв.")
+            else:
+                send_telegram(chat_id, "❗ Формат: <b>/digest</b> <i>30</i> або <b>/digest</b> off")
+
         elif cmd == "/info":
             if not arg:
                 send_telegram(
@@ -577,7 +3491,9 @@ def telegram_webhook():
                     "❗ Формат: <b>/info</b> <i>ABCD0123456789</i>",
                 )
             else:
-                track_no = arg
+                info_args = arg_raw.split()
+                track_no = sanitize_tracking_number(info_args[0])
+                force = len(info_args) > 1 and info_args[1].lower() in INFO_REFRESH_WORDS
 
                 tr = trackings.find_one({"track_no": track_no})
                 if not tr:
@@ -587,30 +3503,473 @@ def telegram_webhook():
                         "Спробуй додати її командою <b>/track</b>.",
                     )
                 else:
-                    data = query_parcels_track(track_no)
-
-                    if not data:
+                    if force or "states" not in tr:
+                        if force:
+                            parcels_cache.invalidate(track_no)
+
+                        try:
+                            data = cached_query_parcels_track(track_no)
+                        except CircuitOpenError:
+                            data = None
+                            if "states" in tr:
+                                send_telegram(chat_id, "⚠️ Parcels зараз недоступний, показую збережені дані.")
+
+                        if data:
+                            apply_tracking_update(track_no, data)
+                            tr = trackings.find_one({"track_no": track_no}) or tr
+
+                    if "states" not in tr:
                         send_telegram(chat_id, "⚠️ Не вдалося отримати дані від Parcels")
                     else:
-                        meta = extract_main_fields(data)
+                        meta = tracking_meta(tr)
+                        for chunk in format_detailed_info_chunks(track_no, meta, meta["states"]):
+                            send_telegram(chat_id, chunk)
+
+    except Exception as e:
+        log.exception("handle_update exception: %r", e)
 
-                        root = data.get("data", data)
-                        shipments = root.get("shipments") or []
-                        shipment = shipments[0] if shipments else {}
-                        history = shipment.get("states") or []
+def remember_update(update_id) -> bool:
+    if update_id is None:
+        return True
 
-                        msg = format_detailed_info(track_no, meta, history)
-                        send_telegram(chat_id, msg)
+    with seen_updates_lock:
+        if update_id in seen_updates:
+            seen_updates.move_to_end(update_id)
+            return False
 
-    except Exception as e:
-        print("telegram_webhook exception:", repr(e))
+        seen_updates[update_id] = True
+        while len(seen_updates) > SEEN_UPDATES_LIMIT:
+            seen_updates.popitem(last=False)
+
+    return True
+
+def forget_update(update_id):
+    with seen_updates_lock:
+        seen_updates.pop(update_id, None)
+
+def update_chat_id(update: dict):
+    message = update.get("message") or update.get("edited_message") or {}
+    return (message.get("chat") or {}).get("id")
+
+class UpdateDispatcher:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = max(1, workers)
+        self.queues = [
+            queue.Queue(maxsize=max(1, queue_size // self.workers))
+            for _ in range(self.workers)
+        ]
+        self.lock = threading.Lock()
+        self.started = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+
+            for i, shard in enumerate(self.queues):
+                threading.Thread(
+                    target=self.work,
+                    args=(shard,),
+                    name=f"update-worker-{i}",
+                    daemon=True,
+                ).start()
+
+            self.started = True
+
+    def shard(self, update: dict) -> queue.Queue:
+        chat_id = update_chat_id(update)
+        return self.queues[hash(chat_id) % self.workers if chat_id is not None else 0]
+
+    def submit(self, update: dict, block: bool = False) -> bool:
+        self.start()
+        try:
+            self.shard(update).put(update, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def work(self, shard: queue.Queue):
+        while True:
+            update = shard.get()
+            try:
+                handle_update(update)
+            except Exception as e:
+                log.exception("update_worker exception: %r", e)
+            finally:
+                shard.task_done()
+
+    def qsize(self) -> int:
+        return sum(shard.qsize() for shard in self.queues)
+
+    def join(self):
+        for shard in self.queues:
+            shard.join()
+
+update_dispatcher = UpdateDispatcher(WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+
+def start_update_workers():
+    update_dispatcher.start()
+
+def claim_update_poller() -> bool:
+    now = datetime.utcnow()
+    telegram_offsets.update_one(
+        {"_id": "getUpdates"},
+        {"$setOnInsert": {"offset": 0}},
+        upsert=True,
+    )
+    result = telegram_offsets.update_one(
+        {
+            "_id": "getUpdates",
+            "$or": [
+                {"lease_owner": INSTANCE_ID},
+                {"lease_until": {"$exists": False}},
+                {"lease_until": {"$lt": now}},
+            ],
+        },
+        {
+            "$set": {
+                "lease_owner": INSTANCE_ID,
+                "lease_until": now + timedelta(seconds=TELEGRAM_POLL_LEASE_SECONDS),
+            }
+        },
+    )
+    return result.matched_count == 1
+
+def load_update_offset() -> int:
+    doc = telegram_offsets.find_one({"_id": "getUpdates"}) or {}
+    return int(doc.get("offset") or 0)
+
+def save_update_offset(offset: int):
+    telegram_offsets.update_one(
+        {"_id": "getUpdates", "lease_owner": INSTANCE_ID},
+        {"$max": {"offset": offset}, "$set": {"updated_at": datetime.utcnow()}},
+    )
+
+def poll_updates_once(offset: int, submit=None) -> int:
+    submit = submit or update_dispatcher.submit
+    updates = telegram_call(
+        "getUpdates",
+        {
+            "offset": offset,
+            "limit": TELEGRAM_POLL_LIMIT,
+            "timeout": TELEGRAM_POLL_TIMEOUT,
+            "allowed_updates": json.dumps(["message", "edited_message"]),
+        },
+        endpoint="telegram_poll",
+    )
+    if updates is None:
+        return -1
+
+    metrics.inc("telegram_updates_polled_total", len(updates))
+
+    for update in updates:
+        update_id = update.get("update_id")
+        if update_id is not None:
+            offset = max(offset, update_id + 1)
+        if remember_update(update_id):
+            submit(update, block=True)
+
+    if updates:
+        save_update_offset(offset)
+
+    return offset
+
+def update_poller(submit=None, stop: threading.Event = None):
+    webhook_cleared = False
+    offset = None
+    stop = stop or threading.Event()
+
+    while not stop.is_set():
+        try:
+            if not claim_update_poller():
+                offset = None
+                time.sleep(TELEGRAM_POLL_LEASE_SECONDS / 2)
+                continue
+
+            if not webhook_cleared:
+                webhook_cleared = telegram_call("deleteWebhook", {}) is not None
+
+            if offset is None:
+                offset = load_update_offset()
+                log.info("📥 Polling Telegram updates instance=%s offset=%d", INSTANCE_ID, offset)
+
+            polled = poll_updates_once(offset, submit)
+            if polled < 0:
+                time.sleep(telegram_backoff(1))
+            else:
+                offset = polled
+        except Exception as e:
+            log.exception("update_poller exception: %r", e)
+            time.sleep(telegram_backoff(1))
 
-    return jsonify({"ok": True})
+def start_update_poller():
+    start_update_workers()
+    threading.Thread(target=update_poller, name="update-poller", daemon=True).start()
+
+def ingest_update(update: dict, submit) -> int:
+    update_id = update.get("update_id")
+
+    if not remember_update(update_id):
+        return 200
+
+    if not submit(update):
+        log.warning("⚠️ Update queue is full, rejecting update %s", update_id)
+        forget_update(update_id)
+        return 503
+
+    return 200
+
+def render_metrics(queue_size: int) -> str:
+    metrics.set("update_queue_size", queue_size)
+    metrics.set("telegram_outbox_pending", telegram_outbox.pending())
+    metrics.set("parcels_pending_lookups", parcels_poller.pending())
+    for stat, value in parcels_cache.stats().items():
+        metrics.set("parcels_cache", value, stat=stat)
+    for stat, value in list_views.stats().items():
+        metrics.set("list_views", value, stat=stat)
+    for stat, value in tracking_index.stats().items():
+        metrics.set("tracking_index", value, stat=stat)
+
+    return metrics.render()
+
+@app.post("/telegram-webhook")
+def telegram_webhook():
+    status = ingest_update(request.get_json(silent=True) or {}, update_dispatcher.submit)
+    return jsonify({"ok": status == 200}), status
 
 @app.get("/")
 def home():
     return "Bot is running!"
 
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(render_metrics(update_dispatcher.qsize()), mimetype="text/plain; version=0.0.4")
+
+class AsyncRuntime:
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.queues = []
+        self.tasks = []
+        self.loop = None
+        self.wakeup = None
+        self.stop_polling = threading.Event()
+        self.handlers = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="update-worker")
+        self.background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="runtime")
+        self.sweep = None
+
+    async def start(self):
+        global transport, telegram_senders_started
+
+        self.loop = asyncio.get_running_loop()
+
+        reason = httpx_unavailable()
+        if not reason:
+            try:
+                transport = AsyncHttpTransport(
+                    HTTP_ENDPOINTS,
+                    HTTP_POOL_SIZE,
+                    HTTP_RETRY_BACKOFF,
+                    HTTP_KEEPALIVE_SECONDS,
+                    loop=self.loop,
+                )
+            except Exception as e:
+                reason = f"httpx transport failed to start: {e!r}"
+
+        if reason:
+            log.warning("⚠️ %s, outbound HTTP stays on %s", reason, transport.name)
+
+        await self.loop.run_in_executor(None, ensure_indexes)
+
+        with telegram_senders_lock:
+            telegram_senders_started = True
+        self.wakeup = asyncio.Event()
+        telegram_outbox.add_listener(lambda: self.loop.call_soon_threadsafe(self.wakeup.set))
+        await self.loop.run_in_executor(None, telegram_outbox.restore)
+        start_outbox_keeper()
+
+        self.queues = [
+            asyncio.Queue(maxsize=max(1, self.queue_size // self.workers))
+            for _ in range(self.workers)
+        ]
+        self.tasks = [asyncio.ensure_future(self.dispatch(shard)) for shard in self.queues]
+        self.tasks += [
+            asyncio.ensure_future(telegram_sender_async(self.wakeup))
+            for _ in range(max(1, TELEGRAM_SENDERS))
+        ]
+        self.tasks.append(asyncio.ensure_future(self.refresh_scheduler()))
+
+        if TELEGRAM_INGESTION == "polling":
+            self.background.submit(update_poller, self.submit_threadsafe, self.stop_polling)
+
+        start_notifier()
+        log.info("🚀 Async runtime started workers=%d senders=%d", self.workers, TELEGRAM_SENDERS)
+
+    def shard(self, update: dict) -> asyncio.Queue:
+        chat_id = update_chat_id(update)
+        return self.queues[hash(chat_id) % self.workers if chat_id is not None else 0]
+
+    def submit(self, update: dict) -> bool:
+        try:
+            self.shard(update).put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def submit_threadsafe(self, update: dict, block: bool = True) -> bool:
+        asyncio.run_coroutine_threadsafe(self.shard(update).put(update), self.loop).result()
+        return True
+
+    def qsize(self) -> int:
+        return sum(shard.qsize() for shard in self.queues)
+
+    async def dispatch(self, shard: asyncio.Queue):
+        while True:
+            update = await shard.get()
+            try:
+                await self.loop.run_in_executor(self.handlers, handle_update, update)
+            except Exception as e:
+                log.exception("update_worker exception: %r", e)
+            finally:
+                shard.task_done()
+
+    async def refresh_scheduler(self):
+        while not refresh_stop.is_set():
+            self.sweep = self.background.submit(refresh_all_trackings)
+            await asyncio.wrap_future(self.sweep)
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+    async def drain(self, deadline: float):
+        for shard in self.queues:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                await asyncio.wait_for(shard.join(), timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+
+        while telegram_outbox.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def stop(self):
+        deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+        log.info("🛑 Async runtime stopping, grace=%.0fs", SHUTDOWN_GRACE_SECONDS)
+
+        refresh_stop.set()
+        self.stop_polling.set()
+
+        await self.drain(deadline)
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        if self.sweep is not None and not self.sweep.done():
+            try:
+                await asyncio.wait_for(
+                    asyncio.wrap_future(self.sweep),
+                    timeout=max(0.1, deadline - time.monotonic()),
+                )
+            except asyncio.TimeoutError:
+                log.warning("⚠️ Refresh sweep still running at shutdown, it will resume from its checkpoint")
+
+        self.handlers.shutdown(wait=False)
+        self.background.shutdown(wait=False)
+
+        if isinstance(transport, AsyncHttpTransport) and transport.loop is self.loop:
+            await transport.aclose()
+
+        log.info("✅ Async runtime stopped, %d Telegram messages left in the outbox", telegram_outbox.pending())
+
+async_runtime = AsyncRuntime(WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE)
+
+async def asgi_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def asgi_respond(send, status: int, body: bytes, content_type: str):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode()),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+async def asgi_lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message["type"] == "lifespan.startup":
+            try:
+                await async_runtime.start()
+            except Exception as e:
+                log.exception("Async runtime startup failed: %r", e)
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+
+        elif message["type"] == "lifespan.shutdown":
+            await async_runtime.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await asgi_lifespan(receive, send)
+        return
+
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    method = scope["method"]
+
+    if path == "/telegram-webhook" and method == "POST":
+        try:
+            update = json.loads(await asgi_body(receive) or b"{}")
+        except ValueError:
+            update = {}
+        status = ingest_update(update if isinstance(update, dict) else {}, async_runtime.submit)
+        body = json.dumps({"ok": status == 200}).encode()
+        await asgi_respond(send, status, body, "application/json")
+
+    elif path == "/" and method in ("GET", "HEAD"):
+        await asgi_respond(send, 200, b"Bot is running!", "text/html; charset=utf-8")
+
+    elif path == "/metrics" and method == "GET":
+        body = render_metrics(async_runtime.qsize()).encode()
+        await asgi_respond(send, 200, body, "text/plain; version=0.0.4")
+
+    else:
+        await asgi_respond(send, 404, b"Not Found", "text/plain")
+
+def run_asgi():
+    if uvicorn is None:
+        log.error("❌ RUNTIME=asgi needs uvicorn (pip install uvicorn)")
+        raise SystemExit(1)
+
+    uvicorn.run(asgi_app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), lifespan="on")
+
 if __name__ == "__main__":
-    refresh_all_trackings()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
+    if RUNTIME == "asgi":
+        run_asgi()
+    else:
+        ensure_indexes()
+        start_telegram_senders()
+        start_notifier()
+        if TELEGRAM_INGESTION == "polling":
+            start_update_poller()
+        else:
+            start_update_workers()
+        start_refresh_scheduler()
+        app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file